@@ -1,6 +1,24 @@
-from typing import Any, Dict, List, Optional
-
-import anthropic
+import asyncio
+import hashlib
+import json
+import random
+import re
+import unicodedata
+from collections import OrderedDict
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    FrozenSet,
+    List,
+    Optional,
+    Tuple,
+)
+
+if TYPE_CHECKING:
+    import numpy as np
 
 
 class AIGenerator:
@@ -16,6 +34,7 @@ Available Tools:
 Tool Usage Guidelines:
 - **Course outline/syllabus queries**: Use get_course_outline to retrieve course title, course link, and complete lesson listings
 - **Course content queries**: Use search_course_content for specific topics, concepts, or detailed materials
+- **Parallel tool usage**: When a query needs several independent lookups, request all of them in a single turn rather than across rounds - they run in parallel
 - **Sequential tool usage**: You may use up to 2 rounds of tool calls when needed for complex queries
 - Use results from first tool call to inform second tool call if additional information is needed
 - Synthesize all tool results into accurate, fact-based responses
@@ -39,19 +58,78 @@ All responses must be:
 Provide only the direct answer to what was asked.
 """
 
-    def __init__(self, api_key: str, model: str):
-        self.client = anthropic.Anthropic(api_key=api_key)
+    # Lowercased once for case-insensitive checks against the prompt
+    SYSTEM_PROMPT_LOWER = SYSTEM_PROMPT.lower()
+
+    # Prompt caching breakpoint applied to the system prompt and tool definitions
+    CACHE_CONTROL = {"type": "ephemeral"}
+
+    # Prefix of the message returned when a follow-up tool round fails
+    TOOL_ROUND_ERROR = "Error in tool execution round"
+
+    # Size caps on tool output fed back to Claude: per result, and across
+    # all rounds before tools are withdrawn and a final answer is forced
+    MAX_TOOL_RESULT_CHARS = 32_000
+    MAX_TOOL_CONTEXT_CHARS = 96_000
+
+    # Transient API statuses retried with backoff, and the attempts allowed;
+    # like the SDK's own retries, every 5xx (529 overloaded included) and
+    # connection errors are retried too
+    RETRY_STATUS_CODES = frozenset({408, 409, 429})
+    MAX_ATTEMPTS = 3
+
+    # Query token that skips cache lookups for a single request
+    NOCACHE_TOKEN = "!nocache"
+
+    # Numbers and capitalised names (after the first word) that must match
+    # exactly for a semantic hit: "lesson 3" and "lesson 4" embed alike
+    ENTITY_PATTERN = re.compile(r"\b(?:\d+|[A-Z][\w.+#-]*)")
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str,
+        embedder: Optional[Callable[[List[str]], Any]] = None,
+        semantic_threshold: float = 0.97,
+        semantic_max: int = 128,
+        client: Optional[Any] = None,
+    ):
+        # An injected client (e.g. a test double) skips the SDK entirely
+        self._http_client = None
+        self.client = client if client is not None else self._build_client(api_key)
         self.model = model
 
         # Pre-build base API parameters
         self.base_params = {"model": self.model, "temperature": 0, "max_tokens": 800}
 
-    def generate_response(
+        # Last assembled system blocks, reused while the history is unchanged
+        self._sys_cache_key: Optional[str] = None
+        self._sys_cache_val: Optional[List[Dict[str, Any]]] = None
+
+        # Tools last passed in and their cache-marked copy sent to the API
+        self._tools_src: Optional[List] = None
+        self._tools_prepared: Optional[List[Dict[str, Any]]] = None
+
+        # Exact-match cache of final answers: key -> (model, answer, sources)
+        self._cache: "OrderedDict[str, Tuple[str, str, List]]" = OrderedDict()
+        self._cache_max = 512
+
+        # Semantic cache for paraphrased queries, enabled when an embedder is
+        # given: one unit-length row per entry, aligned with _sem_entries,
+        # which pairs each cached answer with the entities of its query
+        self._embedder = embedder
+        self._sem_threshold = semantic_threshold
+        self._sem_max = semantic_max
+        self._sem_vecs: Optional["np.ndarray"] = None
+        self._sem_entries: List[Tuple[FrozenSet[str], Tuple[str, str, List]]] = []
+
+    async def generate_response(
         self,
         query: str,
         conversation_history: Optional[str] = None,
         tools: Optional[List] = None,
         tool_manager=None,
+        semantic_key: Optional[str] = None,
     ) -> str:
         """
         Generate AI response with optional tool usage and conversation context.
@@ -61,17 +139,61 @@ Provide only the direct answer to what was asked.
             conversation_history: Previous messages for context
             tools: Available tools the AI can use
             tool_manager: Manager to execute tools
+            semantic_key: The raw user question to match paraphrases on,
+                when query wraps it in a prompt template; defaults to query
 
         Returns:
             Generated response as string
         """
-
-        # Build system content efficiently - avoid string ops when possible
-        system_content = (
-            f"{self.SYSTEM_PROMPT}\n\nPrevious conversation:\n{conversation_history}"
-            if conversation_history
-            else self.SYSTEM_PROMPT
+        answer, _ = await self.generate_response_with_sources(
+            query, conversation_history, tools, tool_manager, semantic_key
         )
+        return answer
+
+    async def generate_response_with_sources(
+        self,
+        query: str,
+        conversation_history: Optional[str] = None,
+        tools: Optional[List] = None,
+        tool_manager=None,
+        semantic_key: Optional[str] = None,
+    ) -> Tuple[str, List]:
+        """
+        Generate AI response along with the sources of this request's tool calls.
+
+        Sources are collected per request rather than read back from shared
+        tool state, so concurrent queries never see each other's sources.
+
+        Returns:
+            Tuple of (generated response, sources list)
+        """
+        if semantic_key is None:
+            semantic_key = query
+        use_cache = self.NOCACHE_TOKEN not in query
+        if not use_cache:
+            query = query.replace(self.NOCACHE_TOKEN, "").strip()
+            semantic_key = semantic_key.replace(self.NOCACHE_TOKEN, "").strip()
+
+        # Serve repeated identical requests without a Claude round trip
+        cache_key = self._cache_key(query, conversation_history, tools)
+        cached = self._cache.get(cache_key) if use_cache else None
+        if cached is not None:
+            self._cache.move_to_end(cache_key)
+            return self._from_cache(cached)
+
+        # Paraphrases of earlier standalone questions share their answer;
+        # with history the answer depends on context, so skip the lookup.
+        # The raw question is embedded, since a shared prompt template would
+        # pull every query closer together
+        semantic = None
+        if self._embedder is not None and not conversation_history:
+            query_vec = await asyncio.to_thread(self._embed, semantic_key)
+            semantic = (query_vec, self._entities(semantic_key))
+            cached = self._semantic_lookup(*semantic) if use_cache else None
+            if cached is not None:
+                return self._from_cache(cached)
+
+        system_content = self._system_content(conversation_history)
 
         # Prepare API call parameters efficiently
         api_params = {
@@ -82,21 +204,280 @@ Provide only the direct answer to what was asked.
 
         # Add tools if available
         if tools:
-            api_params["tools"] = tools
+            api_params["tools"] = self._prepared_tools(tools)
             api_params["tool_choice"] = {"type": "auto"}
 
         # Get response from Claude
-        response = self.client.messages.create(**api_params)
+        response = await self._call_with_retry(api_params)
 
         # Handle tool execution if needed
         if response.stop_reason == "tool_use" and tool_manager:
-            return self._handle_tool_execution(response, api_params, tool_manager)
+            sources: List = []
+            answer = await self._handle_tool_execution(
+                response, api_params, tool_manager, sources
+            )
+            if not answer.startswith(self.TOOL_ROUND_ERROR):
+                self._store(cache_key, answer, sources, semantic)
+            return answer, sources
 
         # Return direct response
-        return response.content[0].text
+        answer = response.content[0].text
+        if response.stop_reason != "tool_use":
+            self._store(cache_key, answer, [], semantic)
+        return answer, []
+
+    def _system_content(
+        self, conversation_history: Optional[str]
+    ) -> List[Dict[str, Any]]:
+        """
+        Build the system blocks for a request.
 
-    def _handle_tool_execution(
-        self, initial_response, base_params: Dict[str, Any], tool_manager
+        The static prompt carries the cache breakpoint; history goes in its own
+        block so the cached prefix stays identical across calls. The result is
+        memoized for the most recent history, so requests that share it reuse
+        the same list instead of rebuilding it.
+        """
+        if (
+            self._sys_cache_val is not None
+            and conversation_history == self._sys_cache_key
+        ):
+            return self._sys_cache_val
+
+        system_content = [
+            {
+                "type": "text",
+                "text": self.SYSTEM_PROMPT,
+                "cache_control": self.CACHE_CONTROL,
+            }
+        ]
+        if conversation_history:
+            system_content.append(
+                {
+                    "type": "text",
+                    "text": "".join(("Previous conversation:\n", conversation_history)),
+                }
+            )
+
+        self._sys_cache_key = conversation_history
+        self._sys_cache_val = system_content
+        return system_content
+
+    def _cache_key(
+        self, query: str, conversation_history: Optional[str], tools: Optional[List]
+    ) -> str:
+        """Hash the output-affecting request fields into a stable cache key"""
+        payload = json.dumps(
+            {
+                "query": unicodedata.normalize("NFC", query).strip(),
+                "system": self.SYSTEM_PROMPT,
+                "conversation_history": conversation_history,
+                "tools": tools,
+                "model": self.model.lower(),
+                "temperature": self.base_params["temperature"],
+                "max_tokens": self.base_params["max_tokens"],
+            },
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _store(
+        self,
+        cache_key: str,
+        answer: str,
+        sources: List,
+        semantic: Optional[Tuple["np.ndarray", FrozenSet[str]]] = None,
+    ):
+        """Store a final answer, evicting the least recently used entry"""
+        entry = (self.model.lower(), answer, list(sources))
+        self._cache[cache_key] = entry
+        if len(self._cache) > self._cache_max:
+            self._cache.popitem(last=False)
+
+        if semantic is None:
+            return
+        import numpy as np
+
+        query_vec, entities = semantic
+        if self._sem_vecs is None:
+            self._sem_vecs = query_vec[np.newaxis, :]
+        else:
+            self._sem_vecs = np.vstack([self._sem_vecs, query_vec])
+        self._sem_entries.append((entities, entry))
+        if len(self._sem_entries) > self._sem_max:
+            self._sem_vecs = self._sem_vecs[1:]
+            self._sem_entries.pop(0)
+
+    @staticmethod
+    def _from_cache(entry: Tuple[str, str, List]) -> Tuple[str, List]:
+        """Return a cached answer with a copy of the sources it was built from"""
+        _, answer, sources = entry
+        return answer, list(sources)
+
+    def _embed(self, query: str) -> "np.ndarray":
+        """Embed a query as a unit vector so dot products are cosine scores"""
+        # Deferred so only the opt-in semantic cache loads numpy
+        import numpy as np
+
+        text = unicodedata.normalize("NFC", query).strip()
+        vec = np.asarray(self._embedder([text])[0], dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    @classmethod
+    def _entities(cls, query: str) -> FrozenSet[str]:
+        """Numbers and names in a query, skipping its capitalised first word"""
+        text = unicodedata.normalize("NFC", query).strip()
+        return frozenset(
+            m.group().lower() for m in cls.ENTITY_PATTERN.finditer(text) if m.start()
+        )
+
+    def _semantic_lookup(
+        self, query_vec: "np.ndarray", entities: FrozenSet[str]
+    ) -> Optional[Tuple[str, str, List]]:
+        """Return the closest cached entry that clears the similarity threshold
+        and names the same entities as the query"""
+        if not self._sem_entries:
+            return None
+        import numpy as np
+
+        scores = self._sem_vecs @ query_vec
+        for best in np.argsort(scores)[::-1]:
+            if scores[best] <= self._sem_threshold:
+                break
+            cached_entities, entry = self._sem_entries[best]
+            if cached_entities == entities:
+                return entry
+        return None
+
+    def _build_client(self, api_key: str):
+        """Create the SDK client on a pooled HTTP/2 connection"""
+        # Deferred so importing this module does not load the SDK
+        import anthropic
+        import httpx
+
+        # Pooled HTTP/2 connections shared by concurrent requests; a custom
+        # transport owns the pool, so the limits are set on it. Neither the
+        # transport nor the SDK retries: _with_retry handles every retry,
+        # failed connections included, so attempts are not multiplied
+        self._http_client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(
+                retries=0,
+                http2=True,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            ),
+            timeout=httpx.Timeout(60.0, connect=5.0),
+        )
+        return anthropic.AsyncAnthropic(
+            api_key=api_key, http_client=self._http_client, max_retries=0
+        )
+
+    async def aclose(self):
+        """Close the pooled HTTP connections"""
+        if self._http_client is not None:
+            await self._http_client.aclose()
+
+    def invalidate(self, model: Optional[str] = None):
+        """Drop cached answers, either all of them or only those for one model"""
+        if model is None:
+            self._cache.clear()
+            self._sem_vecs = None
+            self._sem_entries = []
+            return
+
+        model = model.lower()
+        for key in [k for k, entry in self._cache.items() if entry[0] == model]:
+            del self._cache[key]
+
+        keep = [
+            i for i, (_, entry) in enumerate(self._sem_entries) if entry[0] != model
+        ]
+        self._sem_entries = [self._sem_entries[i] for i in keep]
+        self._sem_vecs = self._sem_vecs[keep] if keep else None
+
+    def _with_cache_breakpoint(self, tools: List) -> List:
+        """Return a copy of tools with a cache breakpoint on the last definition"""
+        return [*tools[:-1], {**tools[-1], "cache_control": self.CACHE_CONTROL}]
+
+    def _prepared_tools(self, tools: List) -> List[Dict[str, Any]]:
+        """Return the cache-marked tools, rebuilding only when the tools change"""
+        if tools is not self._tools_src and tools != self._tools_src:
+            self._tools_src = tools
+            self._tools_prepared = self._with_cache_breakpoint(tools)
+        return self._tools_prepared
+
+    async def _stream_text(self, api_params: Dict[str, Any]) -> str:
+        """Stream a response that cannot request tools and join its text once"""
+
+        async def stream_once() -> str:
+            # A retry restarts the stream, so partial text is never kept
+            parts = []
+            async with self.client.messages.stream(**api_params) as stream:
+                async for text in stream.text_stream:
+                    parts.append(text)
+            return "".join(parts)
+
+        return await self._with_retry(stream_once) or "No response generated"
+
+    def _clip(self, text: str) -> str:
+        """Truncate a tool result that exceeds the per-result size cap"""
+        if len(text) <= self.MAX_TOOL_RESULT_CHARS:
+            return text
+        return text[: self.MAX_TOOL_RESULT_CHARS] + "...[truncated]"
+
+    async def _call_with_retry(self, api_params: Dict[str, Any]):
+        """Create a message, retrying transient errors with backoff"""
+        return await self._with_retry(lambda: self.client.messages.create(**api_params))
+
+    async def _with_retry(self, call: Callable[[], Awaitable[Any]]):
+        """Await call(), retrying transient API and connection errors"""
+        for attempt in range(self.MAX_ATTEMPTS):
+            try:
+                return await call()
+            except Exception as e:
+                if not self.is_retryable(e) or attempt == self.MAX_ATTEMPTS - 1:
+                    raise
+                await asyncio.sleep(self._retry_delay(e, attempt))
+
+    @classmethod
+    def is_retryable(cls, error: Exception) -> bool:
+        """Whether an error is transient: a retryable status or no response"""
+        status_code = getattr(error, "status_code", None)
+        if status_code is not None:
+            return status_code in cls.RETRY_STATUS_CODES or status_code >= 500
+
+        import anthropic
+
+        # Covers APITimeoutError, which subclasses APIConnectionError
+        return isinstance(error, anthropic.APIConnectionError)
+
+    @staticmethod
+    def _retry_delay(error: Exception, attempt: int) -> float:
+        """Seconds to wait before a retry, preferring the server's retry-after"""
+        response = getattr(error, "response", None)
+        retry_after = (
+            response.headers.get("retry-after") if response is not None else None
+        )
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            delay = 2**attempt + random.random()
+        return min(60.0, delay)
+
+    async def _exec_one(self, tool_manager, content_block) -> Tuple[str, List]:
+        """Run a single tool call in a worker thread so sibling calls overlap"""
+        return await asyncio.to_thread(
+            tool_manager.execute_tool_with_sources,
+            content_block.name,
+            **content_block.input,
+        )
+
+    async def _handle_tool_execution(
+        self,
+        initial_response,
+        base_params: Dict[str, Any],
+        tool_manager,
+        sources: Optional[List] = None,
     ):
         """
         Handle sequential execution of tool calls with up to 2 rounds.
@@ -105,6 +486,8 @@ Provide only the direct answer to what was asked.
             initial_response: The response containing tool use requests
             base_params: Base API parameters
             tool_manager: Manager to execute tools
+            sources: Optional list extended with every call's sources, in
+                request order
 
         Returns:
             Final response text after tool execution
@@ -113,8 +496,20 @@ Provide only the direct answer to what was asked.
 
         # Initialize tracking variables
         current_response = initial_response
-        messages = base_params["messages"].copy()
+        # base_params is built per request, so its messages list can grow in place
+        messages = base_params["messages"]
         round_count = 0
+        result_chars = 0
+
+        # Build request parameters once; only the messages list grows per round
+        api_params = {
+            **self.base_params,
+            "messages": messages,
+            "system": base_params["system"],
+        }
+        if "tools" in base_params:
+            api_params["tools"] = base_params["tools"]
+            api_params["tool_choice"] = {"type": "auto"}
 
         # Tool execution loop
         while (
@@ -123,59 +518,69 @@ Provide only the direct answer to what was asked.
             and tool_manager
         ):
 
+            tool_use_blocks = [
+                block for block in current_response.content if block.type == "tool_use"
+            ]
+            # Nothing to feed back, so the latest turn already is the answer
+            if not tool_use_blocks:
+                break
+
             round_count += 1
 
             # Add AI's tool use response to messages
             messages.append({"role": "assistant", "content": current_response.content})
 
-            # Execute all tool calls and collect results
+            # Execute all tool calls concurrently, keeping results in request order
+            raw_results = await asyncio.gather(
+                *(self._exec_one(tool_manager, block) for block in tool_use_blocks),
+                return_exceptions=True,
+            )
+
+            # Failed calls become error results instead of aborting the round;
+            # cancellation and other BaseExceptions still propagate
             tool_results = []
-            for content_block in current_response.content:
-                if content_block.type == "tool_use":
-                    try:
-                        tool_result = tool_manager.execute_tool(
-                            content_block.name, **content_block.input
-                        )
-
-                        tool_results.append(
-                            {
-                                "type": "tool_result",
-                                "tool_use_id": content_block.id,
-                                "content": tool_result,
-                            }
-                        )
-                    except Exception as e:
-                        # Handle tool execution errors gracefully
-                        tool_results.append(
-                            {
-                                "type": "tool_result",
-                                "tool_use_id": content_block.id,
-                                "content": f"Tool execution error: {str(e)}",
-                            }
-                        )
+            for content_block, outcome in zip(tool_use_blocks, raw_results):
+                if isinstance(outcome, BaseException) and not isinstance(
+                    outcome, Exception
+                ):
+                    raise outcome
+                if isinstance(outcome, Exception):
+                    text = f"Tool execution error: {str(outcome)}"
+                else:
+                    text, call_sources = outcome
+                    if sources is not None:
+                        sources.extend(s for s in call_sources if s not in sources)
+                tool_results.append(
+                    {
+                        "type": "tool_result",
+                        "tool_use_id": content_block.id,
+                        "content": self._clip(text),
+                    }
+                )
 
             # Add tool results as single message
             if tool_results:
                 messages.append({"role": "user", "content": tool_results})
-
-            # Prepare next API call parameters
-            api_params = {
-                **self.base_params,
-                "messages": messages,
-                "system": base_params["system"],
-            }
-
-            # Include tools for potential further tool use (except on last round)
-            if round_count < MAX_ROUNDS and "tools" in base_params:
-                api_params["tools"] = base_params["tools"]
-                api_params["tool_choice"] = {"type": "auto"}
+            result_chars += sum(len(result["content"]) for result in tool_results)
 
             # Make next API call
             try:
-                current_response = self.client.messages.create(**api_params)
+                if (
+                    round_count >= MAX_ROUNDS
+                    or result_chars > self.MAX_TOOL_CONTEXT_CHARS
+                ):
+                    # Forbid tool use on the last round so Claude must answer;
+                    # tools stay in the request so the cached prefix still
+                    # matches. There is no stop_reason left to inspect, so
+                    # stream it
+                    if "tools" in api_params:
+                        api_params["tool_choice"] = {"type": "none"}
+                    return await self._stream_text(api_params)
+
+                current_response = await self._call_with_retry(api_params)
             except Exception as e:
                 # Handle API errors gracefully
-                return f"Error in tool execution round {round_count}: {str(e)}"
+                return f"{self.TOOL_ROUND_ERROR} {round_count}: {str(e)}"
 
         # Return final response text
         if hasattr(current_response, "content") and current_response.content:
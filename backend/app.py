@@ -5,6 +5,7 @@ warnings.filterwarnings("ignore", message="resource_tracker: There appear to be.
 import os
 from typing import Any, Dict, List, Optional, Union
 
+from ai_generator import AIGenerator
 from config import config
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
@@ -69,10 +70,13 @@ async def query_documents(request: QueryRequest):
             session_id = rag_system.session_manager.create_session()
 
         # Process query using RAG system
-        answer, sources = rag_system.query(request.query, session_id)
+        answer, sources = await rag_system.query(request.query, session_id)
 
         return QueryResponse(answer=answer, sources=sources, session_id=session_id)
     except Exception as e:
+        # Claude still rate-limited, overloaded or unreachable after retries
+        if AIGenerator.is_retryable(e):
+            raise HTTPException(status_code=503, detail=str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -114,6 +118,12 @@ async def startup_event():
             print(f"Error loading documents: {e}")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release pooled connections to the Anthropic API"""
+    await rag_system.ai_generator.aclose()
+
+
 import os
 from pathlib import Path
 
@@ -24,6 +24,11 @@ class Config:
     MAX_RESULTS: int = 5  # Maximum search results to return
     MAX_HISTORY: int = 2  # Number of conversation messages to remember
 
+    # Response cache settings
+    SEMANTIC_CACHE_ENABLED: bool = False  # Serve paraphrases from cached answers
+    SEMANTIC_CACHE_THRESHOLD: float = 0.97  # Cosine similarity for a paraphrase hit
+    SEMANTIC_CACHE_SIZE: int = 128  # Maximum cached query embeddings
+
     # Database paths
     CHROMA_PATH: str = "./chroma_db"  # ChromaDB storage location
 
@@ -96,16 +96,24 @@ class DocumentProcessor:
 
     def process_course_document(
         self, file_path: str
+    ) -> Tuple[Course, List[CourseChunk]]:
+        """Read a course document from disk and process its text"""
+        return self.process_course_text(self.read_file(file_path), file_path)
+
+    def process_course_text(
+        self, content: str, source_name: str
     ) -> Tuple[Course, List[CourseChunk]]:
         """
-        Process a course document with expected format:
+        Process course text with expected format:
         Line 1: Course Title: [title]
         Line 2: Course Link: [url]
         Line 3: Course Instructor: [instructor]
         Following lines: Lesson markers and content
+
+        source_name is the file name or path the text came from; its base
+        name is the fallback course title.
         """
-        content = self.read_file(file_path)
-        filename = os.path.basename(file_path)
+        filename = os.path.basename(source_name)
 
         lines = content.strip().split("\n")
 
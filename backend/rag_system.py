@@ -12,7 +12,7 @@ from vector_store import VectorStore
 class RAGSystem:
     """Main orchestrator for the Retrieval-Augmented Generation system"""
 
-    def __init__(self, config):
+    def __init__(self, config, ai_client=None):
         self.config = config
 
         # Initialize core components
@@ -23,7 +23,16 @@ class RAGSystem:
             config.CHROMA_PATH, config.EMBEDDING_MODEL, config.MAX_RESULTS
         )
         self.ai_generator = AIGenerator(
-            config.ANTHROPIC_API_KEY, config.ANTHROPIC_MODEL
+            config.ANTHROPIC_API_KEY,
+            config.ANTHROPIC_MODEL,
+            embedder=(
+                self.vector_store.embedding_function
+                if config.SEMANTIC_CACHE_ENABLED
+                else None
+            ),
+            semantic_threshold=config.SEMANTIC_CACHE_THRESHOLD,
+            semantic_max=config.SEMANTIC_CACHE_SIZE,
+            client=ai_client,
         )
         self.session_manager = SessionManager(config.MAX_HISTORY)
 
@@ -41,13 +50,31 @@ class RAGSystem:
         Args:
             file_path: Path to the course document
 
+        Returns:
+            Tuple of (Course object, number of chunks created)
+        """
+        try:
+            content = self.document_processor.read_file(file_path)
+        except OSError as e:
+            print(f"Error processing course document {file_path}: {e}")
+            return None, 0
+        return self.add_course_text(content, file_path)
+
+    def add_course_text(self, text: str, source_name: str) -> Tuple[Course, int]:
+        """
+        Add a course from in-memory text to the knowledge base.
+
+        Args:
+            text: Course document contents
+            source_name: File name or path the text came from
+
         Returns:
             Tuple of (Course object, number of chunks created)
         """
         try:
             # Process the document
-            course, course_chunks = self.document_processor.process_course_document(
-                file_path
+            course, course_chunks = self.document_processor.process_course_text(
+                text, source_name
             )
 
             # Add course metadata to vector store for semantic search
@@ -56,9 +83,12 @@ class RAGSystem:
             # Add course content chunks to vector store
             self.vector_store.add_course_content(course_chunks)
 
+            # Cached answers may no longer reflect the knowledge base
+            self.ai_generator.invalidate()
+
             return course, len(course_chunks)
         except Exception as e:
-            print(f"Error processing course document {file_path}: {e}")
+            print(f"Error processing course document {source_name}: {e}")
             return None, 0
 
     def add_course_folder(
@@ -74,52 +104,81 @@ class RAGSystem:
         Returns:
             Tuple of (total courses added, total chunks created)
         """
-        total_courses = 0
-        total_chunks = 0
-
         # Clear existing data if requested
         if clear_existing:
             print("Clearing existing data for fresh rebuild...")
             self.vector_store.clear_all_data()
+            # Cached answers may no longer reflect the knowledge base
+            self.ai_generator.invalidate()
 
         if not os.path.exists(folder_path):
             print(f"Folder {folder_path} does not exist")
             return 0, 0
 
+        file_paths = [
+            os.path.join(folder_path, file_name)
+            for file_name in os.listdir(folder_path)
+            if file_name.lower().endswith((".pdf", ".docx", ".txt"))
+            and os.path.isfile(os.path.join(folder_path, file_name))
+        ]
+        return self.add_course_documents(file_paths)
+
+    def add_course_documents(self, file_paths: List[str]) -> Tuple[int, int]:
+        """
+        Add several course documents, writing them to the vector store in
+        one batch so the embedding model runs over all new chunks at once.
+
+        Args:
+            file_paths: Paths to course documents
+
+        Returns:
+            Tuple of (total courses added, total chunks created)
+        """
         # Get existing course titles to avoid re-processing
         existing_course_titles = set(self.vector_store.get_existing_course_titles())
 
-        # Process each file in the folder
-        for file_name in os.listdir(folder_path):
-            file_path = os.path.join(folder_path, file_name)
-            if os.path.isfile(file_path) and file_name.lower().endswith(
-                (".pdf", ".docx", ".txt")
-            ):
-                try:
-                    # Check if this course might already exist
-                    # We'll process the document to get the course ID, but only add if new
-                    course, course_chunks = (
-                        self.document_processor.process_course_document(file_path)
-                    )
-
-                    if course and course.title not in existing_course_titles:
-                        # This is a new course - add it to the vector store
-                        self.vector_store.add_course_metadata(course)
-                        self.vector_store.add_course_content(course_chunks)
-                        total_courses += 1
-                        total_chunks += len(course_chunks)
-                        print(
-                            f"Added new course: {course.title} ({len(course_chunks)} chunks)"
-                        )
-                        existing_course_titles.add(course.title)
-                    elif course:
-                        print(f"Course already exists: {course.title} - skipping")
-                except Exception as e:
-                    print(f"Error processing {file_name}: {e}")
-
-        return total_courses, total_chunks
-
-    def query(
+        new_courses = []
+        new_chunks = []
+        chunk_counts = []
+        for file_path in file_paths:
+            try:
+                # We process the document to get the course ID, but only add if new
+                course, course_chunks = self.document_processor.process_course_document(
+                    file_path
+                )
+            except Exception as e:
+                print(f"Error processing {os.path.basename(file_path)}: {e}")
+                continue
+
+            if course and course.title not in existing_course_titles:
+                new_courses.append(course)
+                new_chunks.extend(course_chunks)
+                chunk_counts.append(len(course_chunks))
+                existing_course_titles.add(course.title)
+            elif course:
+                print(f"Course already exists: {course.title} - skipping")
+
+        if not new_courses:
+            return 0, 0
+
+        try:
+            self.vector_store.add_courses_metadata(new_courses)
+            self.vector_store.add_course_content(new_chunks)
+        except Exception as e:
+            titles = ", ".join(course.title for course in new_courses)
+            print(f"Error adding courses {titles}: {e}")
+            return 0, 0
+        finally:
+            # Cached answers may no longer reflect the knowledge base, even
+            # after a partial write
+            self.ai_generator.invalidate()
+
+        for course, chunk_count in zip(new_courses, chunk_counts):
+            print(f"Added new course: {course.title} ({chunk_count} chunks)")
+
+        return len(new_courses), len(new_chunks)
+
+    async def query(
         self, query: str, session_id: Optional[str] = None
     ) -> Tuple[str, List[str]]:
         """
@@ -130,7 +189,7 @@ class RAGSystem:
             session_id: Optional session ID for conversation context
 
         Returns:
-            Tuple of (response, sources list - empty for tool-based approach)
+            Tuple of (response, sources list from this query's tool searches)
         """
         # Create prompt for the AI with clear instructions
         prompt = f"""Answer this question about course materials: {query}"""
@@ -140,20 +199,16 @@ class RAGSystem:
         if session_id:
             history = self.session_manager.get_conversation_history(session_id)
 
-        # Generate response using AI with tools
-        response = self.ai_generator.generate_response(
+        # Generate response using AI with tools; sources come back with this
+        # request's answer since the tool manager is shared between requests
+        response, sources = await self.ai_generator.generate_response_with_sources(
             query=prompt,
             conversation_history=history,
             tools=self.tool_manager.get_tool_definitions(),
             tool_manager=self.tool_manager,
+            semantic_key=query,
         )
 
-        # Get sources from the search tool
-        sources = self.tool_manager.get_last_sources()
-
-        # Reset sources after retrieving them
-        self.tool_manager.reset_sources()
-
         # Update conversation history
         if session_id:
             self.session_manager.add_exchange(session_id, query, response)
@@ -1,6 +1,7 @@
 from abc import ABC, abstractmethod
-from typing import Any, Dict, Optional, Protocol
+from typing import Any, Dict, List, Optional, Protocol, Tuple
 
+import orjson
 from vector_store import SearchResults, VectorStore
 
 
@@ -17,13 +18,16 @@ class Tool(ABC):
         """Execute the tool with given parameters"""
         pass
 
+    def execute_with_sources(self, **kwargs) -> Tuple[str, List]:
+        """Execute the tool and return its result with the sources it used"""
+        return self.execute(**kwargs), []
+
 
 class CourseSearchTool(Tool):
     """Tool for searching course content with semantic course name matching"""
 
     def __init__(self, vector_store: VectorStore):
         self.store = vector_store
-        self.last_sources = []  # Track sources from last search
 
     def get_tool_definition(self) -> Dict[str, Any]:
         """Return Anthropic tool definition for this tool"""
@@ -67,7 +71,23 @@ class CourseSearchTool(Tool):
         Returns:
             Formatted search results or error message
         """
+        return self.execute_with_sources(query, course_name, lesson_number)[0]
+
+    def execute_with_sources(
+        self,
+        query: str,
+        course_name: Optional[str] = None,
+        lesson_number: Optional[int] = None,
+    ) -> Tuple[str, List]:
+        """
+        Execute the search and return the sources behind this call's results.
 
+        Sources travel with the result, so concurrent searches never see
+        each other's.
+
+        Returns:
+            Tuple of (formatted results or error message, sources list)
+        """
         # Use the vector store's unified search interface
         results = self.store.search(
             query=query, course_name=course_name, lesson_number=lesson_number
@@ -75,7 +95,7 @@ class CourseSearchTool(Tool):
 
         # Handle errors
         if results.error:
-            return results.error
+            return results.error, []
 
         # Handle empty results
         if results.is_empty():
@@ -84,13 +104,14 @@ class CourseSearchTool(Tool):
                 filter_info += f" in course '{course_name}'"
             if lesson_number:
                 filter_info += f" in lesson {lesson_number}"
-            return f"No relevant content found{filter_info}."
+            return f"No relevant content found{filter_info}.", []
 
         # Format and return results
         return self._format_results(results)
 
-    def _format_results(self, results: SearchResults) -> str:
-        """Format search results with course and lesson context"""
+    def _format_results(self, results: SearchResults) -> Tuple[str, List]:
+        """Format search results with course and lesson context, returning
+        the formatted text and the sources shown to the UI"""
         formatted = []
         sources = []  # Track sources for the UI
 
@@ -122,10 +143,7 @@ class CourseSearchTool(Tool):
 
             formatted.append(f"{header}\n{doc}")
 
-        # Store sources for retrieval
-        self.last_sources = sources
-
-        return "\n\n".join(formatted)
+        return "\n\n".join(formatted), sources
 
 
 class CourseOutlineTool(Tool):
@@ -181,11 +199,9 @@ class CourseOutlineTool(Tool):
             lessons_json = metadata.get("lessons_json", "[]")
 
             # Parse lessons
-            import json
-
             try:
-                lessons = json.loads(lessons_json)
-            except json.JSONDecodeError:
+                lessons = orjson.loads(lessons_json)
+            except orjson.JSONDecodeError:
                 lessons = []
 
             # Format the outline
@@ -213,6 +229,8 @@ class ToolManager:
 
     def __init__(self):
         self.tools = {}
+        # Definitions are static per tool, so build the list once per registry
+        self._definitions: Optional[list] = None
 
     def register_tool(self, tool: Tool):
         """Register any tool that implements the Tool interface"""
@@ -221,28 +239,23 @@ class ToolManager:
         if not tool_name:
             raise ValueError("Tool must have a 'name' in its definition")
         self.tools[tool_name] = tool
+        self._definitions = None
 
     def get_tool_definitions(self) -> list:
         """Get all tool definitions for Anthropic tool calling"""
-        return [tool.get_tool_definition() for tool in self.tools.values()]
+        if self._definitions is None:
+            self._definitions = [
+                tool.get_tool_definition() for tool in self.tools.values()
+            ]
+        return self._definitions
 
     def execute_tool(self, tool_name: str, **kwargs) -> str:
         """Execute a tool by name with given parameters"""
+        return self.execute_tool_with_sources(tool_name, **kwargs)[0]
+
+    def execute_tool_with_sources(self, tool_name: str, **kwargs) -> Tuple[str, List]:
+        """Execute a tool by name, returning its result and the sources it used"""
         if tool_name not in self.tools:
-            return f"Tool '{tool_name}' not found"
-
-        return self.tools[tool_name].execute(**kwargs)
-
-    def get_last_sources(self) -> list:
-        """Get sources from the last search operation"""
-        # Check all tools for last_sources attribute
-        for tool in self.tools.values():
-            if hasattr(tool, "last_sources") and tool.last_sources:
-                return tool.last_sources
-        return []
-
-    def reset_sources(self):
-        """Reset sources from all tools that track sources"""
-        for tool in self.tools.values():
-            if hasattr(tool, "last_sources"):
-                tool.last_sources = []
+            return f"Tool '{tool_name}' not found", []
+
+        return self.tools[tool_name].execute_with_sources(**kwargs)
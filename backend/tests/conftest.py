@@ -1,21 +1,27 @@
-import os
-import shutil
-import sys
-import tempfile
-from dataclasses import dataclass
-from unittest.mock import Mock
+import zlib
+from collections import deque
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import Annotated, Any, Dict, List, Optional, Union
+from unittest.mock import AsyncMock, Mock, create_autospec
 
 import httpx
+import numpy as np
 import pytest
+from ai_generator import AIGenerator
 from fastapi.testclient import TestClient
+from models import Course, CourseChunk, Lesson
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    Field,
+    NonNegativeInt,
+    StrictStr,
+    TypeAdapter,
+)
 
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
-from ai_generator import AIGenerator  # noqa: E402
-from models import Course, CourseChunk, Lesson  # noqa: E402
-from rag_system import RAGSystem  # noqa: E402
-from search_tools import CourseSearchTool, ToolManager  # noqa: E402
-from vector_store import SearchResults, VectorStore  # noqa: E402
+# vector_store, search_tools and rag_system pull in chromadb and
+# sentence-transformers, so they are imported inside fixtures instead
 
 
 @dataclass
@@ -29,26 +35,169 @@ class TestConfig:
     CHUNK_OVERLAP: int = 100
     MAX_RESULTS: int = 5
     MAX_HISTORY: int = 2
-    CHROMA_PATH: str = ""  # Will be set in fixture
+    SEMANTIC_CACHE_ENABLED: bool = False
+    SEMANTIC_CACHE_THRESHOLD: float = 0.97
+    SEMANTIC_CACHE_SIZE: int = 128
+    CHROMA_PATH: str = ":memory:"  # In-memory store, nothing on disk
+
+
+class FakeEmbedding:
+    """Deterministic bag-of-words embedding standing in for the real model"""
+
+    DIM = 64
+
+    def __call__(self, input):
+        vectors = []
+        for text in input:
+            vector = np.zeros(self.DIM, dtype=np.float32)
+            for token in text.lower().split():
+                vector[zlib.crc32(token.encode()) % self.DIM] += 1.0
+            vectors.append(vector)
+        return vectors
+
+    @staticmethod
+    def name() -> str:
+        return "fake-embedding"
+
+    def is_legacy(self) -> bool:
+        # Tells Chroma not to persist a config for this function
+        return True
+
+
+def _fake_embedding_function(model_name: str) -> FakeEmbedding:
+    return FakeEmbedding()
+
+
+@pytest.fixture(autouse=True)
+def _fake_embeddings(request, monkeypatch):
+    """Swap the sentence-transformer model for FakeEmbedding except in
+    integration tests"""
+    if request.node.get_closest_marker("integration"):
+        return
+    # Imported here, not looked up in sys.modules, so a test that imports
+    # vector_store itself still gets the fake
+    import vector_store
+
+    monkeypatch.setattr(
+        vector_store, "_get_embedding_function", _fake_embedding_function
+    )
+
+
+# Literal queries the integration tests embed with the real model
+REAL_MODEL_QUERIES = ("introduction", "Python basics", "Tell me about Python")
+
+
+@pytest.fixture(scope="session")
+def real_embeddings(shared_config):
+    """The real model's embedding function, warmed with REAL_MODEL_QUERIES in
+    a single batch so later searches for them hit its cache"""
+    from vector_store import _get_embedding_function
+
+    embed = _get_embedding_function(shared_config.EMBEDDING_MODEL)
+    embed(list(REAL_MODEL_QUERIES))
+    return embed
+
+
+@pytest.fixture(scope="class")
+def temp_dir(tmp_path_factory):
+    """Temporary directory shared by the tests of one class; tests must use
+    distinct file names, and folder scans need their own subdirectory"""
+    return str(tmp_path_factory.mktemp("rag_tests"))
 
 
 @pytest.fixture
-def temp_dir():
-    """Create a temporary directory for tests"""
-    temp_dir = tempfile.mkdtemp()
-    yield temp_dir
-    shutil.rmtree(temp_dir)
+def test_config():
+    """Create test configuration with an in-memory Chroma store"""
+    return TestConfig()
+
+
+FAKE_ANSWER = "Fake answer"
+
+
+@pytest.fixture(scope="session")
+def fake_anthropic():
+    """Offline Anthropic client for RAG systems; answers FAKE_ANSWER unless a
+    test sets another return value or seeds responses"""
+    client = AsyncMock()
+    client.messages.create = AsyncMock(return_value=end_resp(FAKE_ANSWER))
+    return client
 
 
 @pytest.fixture
-def test_config(temp_dir):
-    """Create test configuration with temp directory"""
-    config = TestConfig()
-    config.CHROMA_PATH = os.path.join(temp_dir, "test_chroma")
-    return config
+def fresh_rag_system(test_config, fake_anthropic):
+    """A RAG system of its own, for tests that inspect construction"""
+    from rag_system import RAGSystem
+
+    rag = RAGSystem(test_config, ai_client=fake_anthropic)
+    yield rag
+    rag.vector_store.close()
+
+
+@pytest.fixture(scope="session")
+def shared_config():
+    """Test configuration backing the session-wide RAG system"""
+    return TestConfig()
+
+
+@pytest.fixture(scope="session")
+def rag_system(shared_config, fake_anthropic):
+    """One RAG system per session; modules using it reset its state per test"""
+    import vector_store
+    from rag_system import RAGSystem
+
+    # Built before function-scoped patches apply, so fake the model here
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(vector_store, "_get_embedding_function", _fake_embedding_function)
+        rag = RAGSystem(shared_config, ai_client=fake_anthropic)
+    yield rag
+    rag.vector_store.close()
+
+
+@pytest.fixture(scope="session")
+def chroma_client():
+    """In-memory Chroma client for stores that don't test persistence"""
+    from chromadb.config import Settings
+    from vector_store import VectorStore
+
+    settings = Settings(anonymized_telemetry=False)
+    client, database = VectorStore._memory_client(settings)
+    yield client
+    VectorStore._drop_memory_database(settings, database)
+
+
+@pytest.fixture(scope="session")
+def fake_embedding_fn():
+    """A FakeEmbedding for stores that take their embedding function directly"""
+    return FakeEmbedding()
+
+
+@pytest.fixture(scope="session")
+def _shared_store(chroma_client, shared_config, fake_embedding_fn):
+    """One VectorStore per session on the in-memory client"""
+    from vector_store import VectorStore
+
+    return VectorStore(
+        shared_config.CHROMA_PATH,
+        shared_config.EMBEDDING_MODEL,
+        client=chroma_client,
+        embedding_function=fake_embedding_fn,
+    )
 
 
 @pytest.fixture
+def vector_store_factory(_shared_store):
+    """Hand out the session's VectorStore, emptied and set to max_results,
+    instead of building a new store per test"""
+
+    def make(max_results: int = TestConfig.MAX_RESULTS):
+        _shared_store.clear_all_data()
+        _shared_store.max_results = max_results
+        return _shared_store
+
+    return make
+
+
+@pytest.fixture(scope="session")
 def sample_course():
     """Create a sample course for testing"""
     lessons = [
@@ -71,7 +220,7 @@ def sample_course():
     )
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def sample_chunks(sample_course):
     """Create sample course chunks for testing"""
     return [
@@ -96,13 +245,12 @@ def sample_chunks(sample_course):
     ]
 
 
-@pytest.fixture
-def mock_vector_store(sample_chunks):
-    """Create a mock vector store with predictable responses"""
-    mock_store = Mock(spec=VectorStore)
+@pytest.fixture(scope="session")
+def sample_search_results(sample_chunks):
+    """Build the successful search results for sample_chunks once per run"""
+    from vector_store import SearchResults
 
-    # Mock successful search results
-    mock_store.search.return_value = SearchResults(
+    return SearchResults(
         documents=[chunk.content for chunk in sample_chunks],
         metadata=[
             {
@@ -115,16 +263,70 @@ def mock_vector_store(sample_chunks):
         distances=[0.1, 0.2, 0.3],
     )
 
-    # Mock course resolution
-    mock_store._resolve_course_name.return_value = "Test Course"
-    mock_store.get_lesson_link.return_value = "http://example.com/lesson1"
 
-    return mock_store
+@dataclass
+class FakeCatalog:
+    """Course catalog collection stub answering get() with a canned result"""
+
+    result: Dict = field(default_factory=lambda: {"metadatas": []})
+    error: Optional[Exception] = None
+
+    def get(self, ids=None, **kwargs):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+@dataclass
+class FakeVectorStore:
+    """The slice of VectorStore the search tools use, returning canned values
+    and recording each call as (method, kwargs) in calls"""
+
+    search_results: Any
+    resolved_course: Optional[str] = "Test Course"
+    lesson_link: Optional[str] = "http://example.com/lesson1"
+    course_catalog: FakeCatalog = field(default_factory=FakeCatalog)
+    calls: List = field(default_factory=list)
+
+    def search(self, query, course_name=None, lesson_number=None, limit=None):
+        self.calls.append(
+            (
+                "search",
+                {
+                    "query": query,
+                    "course_name": course_name,
+                    "lesson_number": lesson_number,
+                    "limit": limit,
+                },
+            )
+        )
+        return self.search_results
+
+    def _resolve_course_name(self, course_name):
+        self.calls.append(("_resolve_course_name", {"course_name": course_name}))
+        return self.resolved_course
+
+    def get_lesson_link(self, course_title, lesson_number):
+        self.calls.append(
+            (
+                "get_lesson_link",
+                {"course_title": course_title, "lesson_number": lesson_number},
+            )
+        )
+        return self.lesson_link
+
+
+@pytest.fixture
+def mock_vector_store(sample_search_results):
+    """Create a fake vector store with predictable responses"""
+    return FakeVectorStore(search_results=sample_search_results)
 
 
 @pytest.fixture
 def real_vector_store(test_config, sample_course, sample_chunks):
     """Create a real vector store with test data"""
+    from vector_store import VectorStore
+
     store = VectorStore(
         test_config.CHROMA_PATH, test_config.EMBEDDING_MODEL, test_config.MAX_RESULTS
     )
@@ -133,62 +335,192 @@ def real_vector_store(test_config, sample_course, sample_chunks):
     store.add_course_metadata(sample_course)
     store.add_course_content(sample_chunks)
 
-    return store
+    yield store
+    store.close()
 
 
 @pytest.fixture
 def mock_anthropic_client():
-    """Create a mock Anthropic client"""
-    mock_client = Mock()
+    """Create a mock async Anthropic client"""
+    mock_client = AsyncMock()
 
-    # Don't pre-configure the client - let individual tests set their own expectations
-    # This allows tests to have full control over mock behavior
+    # Tests only set return_value or side_effect on the awaitable create
+    mock_client.messages.create = AsyncMock()
 
     return mock_client
 
 
+@dataclass(frozen=True, slots=True)
+class TextBlock:
+    """Lightweight stand-in for a text content block"""
+
+    text: str
+    type: str = "text"
+
+
+def tool_use_resp(name: str, tool_id: str, tool_input: dict) -> SimpleNamespace:
+    """Build a response that requests a single tool call"""
+    return SimpleNamespace(
+        stop_reason="tool_use",
+        content=[
+            SimpleNamespace(type="tool_use", name=name, id=tool_id, input=tool_input)
+        ],
+    )
+
+
+def end_resp(text: str) -> SimpleNamespace:
+    """Build a final response carrying a single text block"""
+    return SimpleNamespace(stop_reason="end_turn", content=[TextBlock(text)])
+
+
+@pytest.fixture
+def spec_message():
+    """An autospecced Message for responses assembled block by block"""
+    from anthropic.types import Message
+
+    return create_autospec(Message, instance=True)
+
+
+@pytest.fixture
+def spec_tool_use_block():
+    """Factory for autospecced ToolUseBlock instances"""
+    from anthropic.types import ToolUseBlock
+
+    def make(name: str, tool_id: str, tool_input: dict):
+        block = create_autospec(ToolUseBlock, instance=True)
+        block.type = "tool_use"
+        block.name = name
+        block.id = tool_id
+        block.input = tool_input
+        return block
+
+    return make
+
+
+def seed_responses(client, *responses) -> deque:
+    """Queue responses (or exceptions to raise) for successive create calls"""
+    queue = deque(responses)
+
+    def next_response(**_):
+        response = queue.popleft()
+        if isinstance(response, BaseException):
+            raise response
+        return response
+
+    client.messages.create.side_effect = next_response
+    return queue
+
+
+class FakeTextStream:
+    """Stand-in for the async context manager returned by messages.stream"""
+
+    def __init__(self, *chunks: str):
+        self.chunks = chunks
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    @property
+    def text_stream(self):
+        return self._iter_chunks()
+
+    async def _iter_chunks(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+@pytest.fixture(scope="session")
+def shared_ai_gen():
+    """One AIGenerator for tests that rebind its client via monkeypatch"""
+    return AIGenerator("test-key", "test-model", client=AsyncMock())
+
+
+@pytest.fixture(scope="module")
+def _tool_setup(shared_ai_gen):
+    """Mocks for tool-execution tests, built once per module"""
+    client = AsyncMock()
+    client.messages.create = AsyncMock()
+    return {
+        "client": client,
+        "tm": Mock(),
+        "ai": shared_ai_gen,
+        "base": {
+            "model": "test-model",
+            "messages": [{"role": "user", "content": "Test query"}],
+            "system": "Test system prompt",
+            "tools": [{"name": "search_course_content"}],
+        },
+    }
+
+
+@pytest.fixture
+def tool_setup(_tool_setup, monkeypatch):
+    """Reset the shared tool-execution mocks and hand out fresh base params"""
+    for mock in (_tool_setup["client"], _tool_setup["tm"]):
+        mock.reset_mock(return_value=True, side_effect=True)
+    monkeypatch.setattr(_tool_setup["ai"], "client", _tool_setup["client"])
+
+    # The tool loop appends to the messages list, so each test gets its own
+    base = _tool_setup["base"]
+    yield {
+        **_tool_setup,
+        "base": {**base, "messages": [dict(m) for m in base["messages"]]},
+    }
+
+
 @pytest.fixture
 def mock_ai_generator(mock_anthropic_client):
     """Create AI generator with mocked client"""
-    ai_gen = AIGenerator("test-key", "test-model")
-    ai_gen.client = mock_anthropic_client
-    return ai_gen
+    return AIGenerator("test-key", "test-model", client=mock_anthropic_client)
 
 
 @pytest.fixture
 def course_search_tool(mock_vector_store):
     """Create a CourseSearchTool with mock vector store"""
+    from search_tools import CourseSearchTool
+
     return CourseSearchTool(mock_vector_store)
 
 
 @pytest.fixture
 def tool_manager(course_search_tool):
     """Create a ToolManager with registered tools"""
+    from search_tools import ToolManager
+
     manager = ToolManager()
     manager.register_tool(course_search_tool)
     return manager
 
 
 # Empty search results for testing failure cases
-@pytest.fixture
+@pytest.fixture(scope="session")
 def empty_search_results():
     """Create empty search results for testing"""
+    from vector_store import SearchResults
+
     return SearchResults(documents=[], metadata=[], distances=[])
 
 
 # Error search results for testing error cases
-@pytest.fixture
+@pytest.fixture(scope="session")
 def error_search_results():
     """Create error search results for testing"""
+    from vector_store import SearchResults
+
     return SearchResults.empty("Test error message")
 
 
 # API Testing Fixtures
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def mock_rag_system(sample_course, sample_chunks):
     """Create a mock RAG system for API testing"""
+    from rag_system import RAGSystem
+
     mock_rag = Mock(spec=RAGSystem)
 
     # Mock successful query response
@@ -210,7 +542,43 @@ def mock_rag_system(sample_course, sample_chunks):
     return mock_rag
 
 
-@pytest.fixture
+NonEmptyStr = Annotated[StrictStr, Field(min_length=1)]
+
+
+class QueryResponseShape(BaseModel):
+    """Expected /api/query response body"""
+
+    model_config = ConfigDict(strict=True)
+
+    answer: NonEmptyStr
+    sources: List[Union[StrictStr, Dict[str, StrictStr]]]
+    session_id: NonEmptyStr
+
+
+class CoursesResponseShape(BaseModel):
+    """Expected /api/courses response body"""
+
+    model_config = ConfigDict(strict=True)
+
+    total_courses: NonNegativeInt
+    course_titles: List[StrictStr]
+
+
+class SessionResponseShape(BaseModel):
+    """Expected /api/session/new response body"""
+
+    model_config = ConfigDict(strict=True)
+
+    session_id: NonEmptyStr
+
+
+# Adapters for validating raw API response bytes, compiled once per session
+QUERY_RESPONSE = TypeAdapter(QueryResponseShape)
+COURSES_RESPONSE = TypeAdapter(CoursesResponseShape)
+SESSION_RESPONSE = TypeAdapter(SessionResponseShape)
+
+
+@pytest.fixture(scope="session")
 def test_app():
     """Create a test FastAPI app without static file mounting to avoid import issues"""
     from typing import Dict, List, Optional, Union
@@ -253,10 +621,12 @@ def test_app():
             if not session_id:
                 session_id = rag_system.session_manager.create_session()
 
-            answer, sources = rag_system.query(request.query, session_id)
+            answer, sources = await rag_system.query(request.query, session_id)
 
             return QueryResponse(answer=answer, sources=sources, session_id=session_id)
         except Exception as e:
+            if AIGenerator.is_retryable(e):
+                raise HTTPException(status_code=503, detail=str(e))
             raise HTTPException(status_code=500, detail=str(e))
 
     @app.get("/api/courses", response_model=CourseStats)
@@ -290,9 +660,9 @@ def test_app():
     return app
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def test_client(test_app, mock_rag_system):
-    """Create a test client with mocked dependencies"""
+    """Create a test client with mocked dependencies, shared by the session"""
     # Inject mock RAG system into the app
     test_app.state.rag_system = mock_rag_system
 
@@ -1,35 +1,130 @@
-import os
-import sys
-from unittest.mock import MagicMock, Mock, patch
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, Mock, patch
 
+import anthropic
+import httpx
 import pytest
-
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
 from ai_generator import AIGenerator
 
+from .conftest import (
+    FakeTextStream,
+    TextBlock,
+    end_resp,
+    seed_responses,
+    tool_use_resp,
+)
+
+# Follow-up rounds of _handle_tool_execution: the first tool_use response,
+# what each tool call returns or raises, the responses to later create calls
+# and the text streamed once max rounds is reached
+SEQUENTIAL_SCENARIOS = {
+    "two_rounds": {
+        "first": tool_use_resp(
+            "get_course_outline", "tool_round_1", {"course_name": "ML Course"}
+        ),
+        "tool_effects": [
+            "Course found: Machine Learning Basics",
+            "Related courses: Advanced ML, Deep Learning",
+        ],
+        "responses": [
+            tool_use_resp(
+                "search_course_content",
+                "tool_round_2",
+                {"query": "machine learning", "course_name": "ML Course"},
+            )
+        ],
+        "stream_chunks": ("Based on both tool results, ", "here's your answer"),
+        "tool_calls": [
+            ("get_course_outline", {"course_name": "ML Course"}),
+            (
+                "search_course_content",
+                {"query": "machine learning", "course_name": "ML Course"},
+            ),
+        ],
+        "result": "Based on both tool results, here's your answer",
+    },
+    "max_rounds_exceeded": {
+        "first": tool_use_resp(
+            "search_course_content", "tool_1", {"query": "first search"}
+        ),
+        "tool_effects": ["First tool result", "Second tool result"],
+        "responses": [
+            tool_use_resp("search_course_content", "tool_2", {"query": "second search"})
+        ],
+        "stream_chunks": ("Final answer without tools",),
+        "tool_calls": [
+            ("search_course_content", {"query": "first search"}),
+            ("search_course_content", {"query": "second search"}),
+        ],
+        "result": "Final answer without tools",
+    },
+    "error_in_second_round": {
+        "first": tool_use_resp(
+            "search_course_content", "tool_1", {"query": "first search"}
+        ),
+        "tool_effects": ["First tool result", Exception("Tool execution failed")],
+        "responses": [
+            tool_use_resp("search_course_content", "tool_2", {"query": "second search"})
+        ],
+        "stream_chunks": ("Response with error handled",),
+        "tool_calls": [
+            ("search_course_content", {"query": "first search"}),
+            ("search_course_content", {"query": "second search"}),
+        ],
+        "result": "Response with error handled",
+    },
+    "early_termination": {
+        "first": tool_use_resp("search_course_content", "tool_1", {"query": "search"}),
+        "tool_effects": ["Tool result"],
+        "responses": [end_resp("Final answer after one tool use")],
+        "stream_chunks": (),
+        "tool_calls": [("search_course_content", {"query": "search"})],
+        "result": "Final answer after one tool use",
+    },
+}
+
+
+@pytest.fixture(autouse=True)
+def _patch_anthropic(monkeypatch):
+    """Skip real SDK client construction"""
+    monkeypatch.setattr("anthropic.AsyncAnthropic", lambda **kwargs: AsyncMock())
+
 
 class TestAIGenerator:
     """Test suite for AIGenerator functionality"""
 
+    async def test_injected_client_skips_sdk(self, monkeypatch):
+        """Test that a supplied client is used without building an SDK client"""
+        sdk = Mock()
+        monkeypatch.setattr("anthropic.AsyncAnthropic", sdk)
+        client = AsyncMock()
+
+        ai_gen = AIGenerator("test-key", "test-model", client=client)
+
+        sdk.assert_not_called()
+        assert ai_gen.client is client
+        assert ai_gen._http_client is None
+        await ai_gen.aclose()
+
     def test_init(self):
         """Test AIGenerator initialization"""
-        ai_gen = AIGenerator("test-key", "test-model")
+        # An injected client keeps the test from opening an HTTP pool
+        ai_gen = AIGenerator("test-key", "test-model", client=AsyncMock())
 
         assert ai_gen.model == "test-model"
         assert ai_gen.base_params["model"] == "test-model"
         assert ai_gen.base_params["temperature"] == 0
         assert ai_gen.base_params["max_tokens"] == 800
 
-    def test_generate_response_no_tools(self, mock_ai_generator, mock_anthropic_client):
+    async def test_generate_response_no_tools(
+        self, mock_ai_generator, mock_anthropic_client
+    ):
         """Test response generation without tools"""
         # Setup mock for direct response (no tools)
-        mock_response = Mock()
-        mock_response.stop_reason = "end_turn"
-        mock_response.content = [Mock(text="Direct response without tools")]
+        mock_response = end_resp("Direct response without tools")
         mock_anthropic_client.messages.create.return_value = mock_response
 
-        result = mock_ai_generator.generate_response("What is AI?")
+        result = await mock_ai_generator.generate_response("What is AI?")
 
         # Verify API was called correctly
         mock_anthropic_client.messages.create.assert_called_once()
@@ -41,39 +136,39 @@ class TestAIGenerator:
 
         assert result == "Direct response without tools"
 
-    def test_generate_response_with_conversation_history(
+    async def test_generate_response_with_conversation_history(
         self, mock_ai_generator, mock_anthropic_client
     ):
         """Test response generation with conversation history"""
-        mock_response = Mock()
-        mock_response.stop_reason = "end_turn"
-        mock_response.content = [Mock(text="Response with history")]
+        mock_response = end_resp("Response with history")
         mock_anthropic_client.messages.create.return_value = mock_response
 
         history = "Previous conversation context"
-        result = mock_ai_generator.generate_response(
+        result = await mock_ai_generator.generate_response(
             "New question", conversation_history=history
         )
 
         call_args = mock_anthropic_client.messages.create.call_args[1]
 
-        # Check system prompt includes history
-        assert history in call_args["system"]
-        assert mock_ai_generator.SYSTEM_PROMPT in call_args["system"]
+        # Check static prompt is cached and history follows in its own block
+        system_blocks = call_args["system"]
+        assert len(system_blocks) == 2
+        assert system_blocks[0]["text"] == mock_ai_generator.SYSTEM_PROMPT
+        assert system_blocks[0]["cache_control"] == {"type": "ephemeral"}
+        assert history in system_blocks[1]["text"]
+        assert "cache_control" not in system_blocks[1]
 
         assert result == "Response with history"
 
-    def test_generate_response_with_tools_no_tool_use(
+    async def test_generate_response_with_tools_no_tool_use(
         self, mock_ai_generator, mock_anthropic_client, tool_manager
     ):
         """Test response generation with tools available but not used"""
-        mock_response = Mock()
-        mock_response.stop_reason = "end_turn"
-        mock_response.content = [Mock(text="Response without tool use")]
+        mock_response = end_resp("Response without tool use")
         mock_anthropic_client.messages.create.return_value = mock_response
 
         tools = tool_manager.get_tool_definitions()
-        result = mock_ai_generator.generate_response(
+        result = await mock_ai_generator.generate_response(
             "General question", tools=tools, tool_manager=tool_manager
         )
 
@@ -85,9 +180,51 @@ class TestAIGenerator:
         assert len(call_args["tools"]) == 1
         assert call_args["tools"][0]["name"] == "search_course_content"
 
+        # Cache breakpoint is added to the request copy, not the caller's list
+        assert call_args["tools"][-1]["cache_control"] == {"type": "ephemeral"}
+        assert "cache_control" not in tools[-1]
+
         assert result == "Response without tool use"
 
-    def test_generate_response_with_tool_use(
+    async def test_tools_block_identical_across_tool_rounds(
+        self, mock_ai_generator, mock_anthropic_client
+    ):
+        """Test that every tool round sends the same cache-marked tools block"""
+        mock_tool_manager = Mock()
+        mock_tool_manager.execute_tool_with_sources.return_value = ("Result", [])
+        seed_responses(
+            mock_anthropic_client,
+            tool_use_resp("search_course_content", "tool_1", {"query": "first"}),
+            tool_use_resp("search_course_content", "tool_2", {"query": "second"}),
+        )
+        mock_anthropic_client.messages.stream = Mock(
+            return_value=FakeTextStream("Final answer")
+        )
+
+        tools = [{"name": "search_course_content"}]
+        result = await mock_ai_generator.generate_response(
+            "Search twice", tools=tools, tool_manager=mock_tool_manager
+        )
+
+        requests = [
+            c.kwargs for c in mock_anthropic_client.messages.create.call_args_list
+        ]
+        requests.append(mock_anthropic_client.messages.stream.call_args.kwargs)
+        assert len(requests) == 3
+
+        # A changed tools block would change the cached prefix on the last round
+        first_tools = requests[0]["tools"]
+        assert first_tools[-1]["cache_control"] == {"type": "ephemeral"}
+        assert all(r["tools"] == first_tools for r in requests)
+        assert [r["tool_choice"] for r in requests] == [
+            {"type": "auto"},
+            {"type": "auto"},
+            {"type": "none"},
+        ]
+
+        assert result == "Final answer"
+
+    async def test_generate_response_with_tool_use(
         self, mock_ai_generator, mock_anthropic_client
     ):
         """Test response generation with tool use"""
@@ -96,31 +233,24 @@ class TestAIGenerator:
         mock_tool_manager.get_tool_definitions.return_value = [
             {"name": "search_course_content", "description": "Search course content"}
         ]
-        mock_tool_manager.execute_tool.return_value = "Tool result content"
+        mock_tool_manager.execute_tool_with_sources.return_value = (
+            "Tool result content",
+            ["Test Course - Lesson 1"],
+        )
 
         # First response: tool use
-        mock_tool_response = Mock()
-        mock_tool_response.stop_reason = "tool_use"
-        mock_content_block = Mock()
-        mock_content_block.type = "tool_use"
-        mock_content_block.name = "search_course_content"
-        mock_content_block.id = "tool_123"
-        mock_content_block.input = {"query": "test search"}
-        mock_tool_response.content = [mock_content_block]
+        mock_tool_response = tool_use_resp(
+            "search_course_content", "tool_123", {"query": "test search"}
+        )
 
         # Second response: final answer
-        mock_final_response = Mock()
-        mock_final_response.stop_reason = "end_turn"
-        mock_final_response.content = [Mock(text="Final response after tool use")]
+        mock_final_response = end_resp("Final response after tool use")
 
         # Configure mock to return different responses on each call
-        mock_anthropic_client.messages.create.side_effect = [
-            mock_tool_response,
-            mock_final_response,
-        ]
+        seed_responses(mock_anthropic_client, mock_tool_response, mock_final_response)
 
         tools = mock_tool_manager.get_tool_definitions()
-        result = mock_ai_generator.generate_response(
+        result = await mock_ai_generator.generate_response(
             "Search for course content", tools=tools, tool_manager=mock_tool_manager
         )
 
@@ -128,44 +258,34 @@ class TestAIGenerator:
         assert mock_anthropic_client.messages.create.call_count == 2
 
         # Verify tool was executed
-        mock_tool_manager.execute_tool.assert_called_once_with(
-            "search_course_content", query="test search"
-        )
+        assert mock_tool_manager.execute_tool_with_sources.call_count == 1
+        args, kwargs = mock_tool_manager.execute_tool_with_sources.call_args
+        assert args == ("search_course_content",)
+        assert kwargs == {"query": "test search"}
 
         assert result == "Final response after tool use"
 
-    def test_handle_tool_execution_single_tool(self):
+    async def test_handle_tool_execution_single_tool(self, tool_setup):
         """Test handling of single tool execution"""
-        # Create fresh mocks for this test
-        mock_anthropic_client = Mock()
-        ai_gen = AIGenerator("test-key", "test-model")
-        ai_gen.client = mock_anthropic_client
-
-        # Create mock tool manager
-        mock_tool_manager = Mock()
-        mock_tool_manager.execute_tool.return_value = (
-            "Python is a programming language..."
+        ai_gen = tool_setup["ai"]
+        mock_anthropic_client = tool_setup["client"]
+        mock_tool_manager = tool_setup["tm"]
+
+        # Configure the shared tool manager
+        mock_tool_manager.execute_tool_with_sources.return_value = (
+            "Python is a programming language...",
+            [],
         )
 
         # Mock initial response with tool use
-        mock_initial_response = Mock()
-        mock_initial_response.stop_reason = "tool_use"
-        mock_content_block = Mock()
-        mock_content_block.type = "tool_use"
-        mock_content_block.name = "search_course_content"
-        mock_content_block.id = "tool_456"
-        mock_content_block.input = {
-            "query": "Python basics",
-            "course_name": "Programming Course",
-        }
-        mock_initial_response.content = [mock_content_block]
+        mock_initial_response = tool_use_resp(
+            "search_course_content",
+            "tool_456",
+            {"query": "Python basics", "course_name": "Programming Course"},
+        )
 
         # Mock final response
-        mock_final_response = Mock()
-        mock_final_response.stop_reason = "end_turn"
-        mock_final_response.content = [
-            Mock(text="Here's what I found about Python basics")
-        ]
+        mock_final_response = end_resp("Here's what I found about Python basics")
         mock_anthropic_client.messages.create.return_value = mock_final_response
 
         base_params = {
@@ -175,16 +295,15 @@ class TestAIGenerator:
             "tools": [{"name": "search_course_content"}],
         }
 
-        result = ai_gen._handle_tool_execution(
+        result = await ai_gen._handle_tool_execution(
             mock_initial_response, base_params, mock_tool_manager
         )
 
         # Verify tool was executed
-        mock_tool_manager.execute_tool.assert_called_once_with(
-            "search_course_content",
-            query="Python basics",
-            course_name="Programming Course",
-        )
+        assert mock_tool_manager.execute_tool_with_sources.call_count == 1
+        args, kwargs = mock_tool_manager.execute_tool_with_sources.call_args
+        assert args == ("search_course_content",)
+        assert kwargs == {"query": "Python basics", "course_name": "Programming Course"}
 
         # Verify final API call structure
         final_call_args = mock_anthropic_client.messages.create.call_args[1]
@@ -205,44 +324,34 @@ class TestAIGenerator:
 
         assert result == "Here's what I found about Python basics"
 
-    def test_handle_tool_execution_multiple_tools(self):
+    async def test_handle_tool_execution_multiple_tools(
+        self, tool_setup, spec_message, spec_tool_use_block
+    ):
         """Test handling of multiple tool executions in one response"""
-        # Create fresh mocks for this test
-        mock_anthropic_client = Mock()
-        ai_gen = AIGenerator("test-key", "test-model")
-        ai_gen.client = mock_anthropic_client
-
-        # Create mock tool manager
-        mock_tool_manager = Mock()
-        mock_tool_manager.execute_tool.side_effect = [
-            "Python content...",
-            "JavaScript content...",
-        ]
+        ai_gen = tool_setup["ai"]
+        mock_anthropic_client = tool_setup["client"]
+        mock_tool_manager = tool_setup["tm"]
+
+        # Configure the shared tool manager; results depend on the call, not its order
+        mock_tool_manager.execute_tool_with_sources.side_effect = lambda name, query: (
+            f"{query.split()[0]} content...",
+            [f"{query.split()[0]} Course", "Shared Course"],
+        )
 
         # Mock initial response with multiple tool uses
-        mock_initial_response = Mock()
+        mock_initial_response = spec_message
         mock_initial_response.stop_reason = "tool_use"
-
-        mock_content_block_1 = Mock()
-        mock_content_block_1.type = "tool_use"
-        mock_content_block_1.name = "search_course_content"
-        mock_content_block_1.id = "tool_1"
-        mock_content_block_1.input = {"query": "Python basics"}
-
-        mock_content_block_2 = Mock()
-        mock_content_block_2.type = "tool_use"
-        mock_content_block_2.name = "search_course_content"
-        mock_content_block_2.id = "tool_2"
-        mock_content_block_2.input = {"query": "JavaScript fundamentals"}
-
-        mock_initial_response.content = [mock_content_block_1, mock_content_block_2]
+        mock_initial_response.content = [
+            spec_tool_use_block(
+                "search_course_content", "tool_1", {"query": "Python basics"}
+            ),
+            spec_tool_use_block(
+                "search_course_content", "tool_2", {"query": "JavaScript fundamentals"}
+            ),
+        ]
 
         # Mock final response
-        mock_final_response = Mock()
-        mock_final_response.stop_reason = "end_turn"
-        mock_final_response.content = [
-            Mock(text="Here's information about both languages")
-        ]
+        mock_final_response = end_resp("Here's information about both languages")
         mock_anthropic_client.messages.create.return_value = mock_final_response
 
         base_params = {
@@ -252,23 +361,261 @@ class TestAIGenerator:
             "tools": [{"name": "search_course_content"}],
         }
 
-        result = ai_gen._handle_tool_execution(
-            mock_initial_response, base_params, mock_tool_manager
+        sources = []
+        result = await ai_gen._handle_tool_execution(
+            mock_initial_response, base_params, mock_tool_manager, sources
         )
 
         # Verify both tools were executed
-        assert mock_tool_manager.execute_tool.call_count == 2
+        assert mock_tool_manager.execute_tool_with_sources.call_count == 2
+
+        # Every call's sources are kept, in request order and without repeats
+        assert sources == ["Python Course", "Shared Course", "JavaScript Course"]
 
         # Check tool result structure
         final_call_args = mock_anthropic_client.messages.create.call_args[1]
         tool_results = final_call_args["messages"][2]["content"]
 
-        assert len(tool_results) == 2
-        assert tool_results[0]["tool_use_id"] == "tool_1"
-        assert tool_results[1]["tool_use_id"] == "tool_2"
+        # Tools run concurrently, so match results by tool_use_id
+        results_by_id = {r["tool_use_id"]: r["content"] for r in tool_results}
+        assert results_by_id == {
+            "tool_1": "Python content...",
+            "tool_2": "JavaScript content...",
+        }
 
         assert result == "Here's information about both languages"
 
+    async def test_handle_tool_execution_one_tool_fails(
+        self, tool_setup, spec_message, spec_tool_use_block
+    ):
+        """Test that a failing tool does not affect sibling tool calls"""
+        ai_gen = tool_setup["ai"]
+        mock_anthropic_client = tool_setup["client"]
+        mock_tool_manager = tool_setup["tm"]
+
+        def execute_tool(name, **kwargs):
+            if kwargs["query"] == "broken":
+                raise Exception("Search failed")
+            return f"Results for {kwargs['query']}", []
+
+        mock_tool_manager.execute_tool_with_sources.side_effect = execute_tool
+
+        mock_initial_response = spec_message
+        mock_initial_response.stop_reason = "tool_use"
+        mock_initial_response.content = [
+            spec_tool_use_block("search_course_content", tool_id, {"query": query})
+            for tool_id, query in [("tool_1", "broken"), ("tool_2", "working")]
+        ]
+
+        mock_final_response = end_resp("Partial answer")
+        mock_anthropic_client.messages.create.return_value = mock_final_response
+
+        base_params = tool_setup["base"]
+
+        result = await ai_gen._handle_tool_execution(
+            mock_initial_response, base_params, mock_tool_manager
+        )
+
+        final_call_args = mock_anthropic_client.messages.create.call_args[1]
+        tool_results = final_call_args["messages"][2]["content"]
+
+        assert [r["tool_use_id"] for r in tool_results] == ["tool_1", "tool_2"]
+        assert tool_results[0]["content"] == "Tool execution error: Search failed"
+        assert tool_results[1]["content"] == "Results for working"
+        assert result == "Partial answer"
+
+    async def test_tool_cancellation_is_not_reported_as_error(
+        self, tool_setup, spec_message, spec_tool_use_block
+    ):
+        """Test that a cancelled tool call propagates instead of becoming a result"""
+        ai_gen = tool_setup["ai"]
+        mock_anthropic_client = tool_setup["client"]
+        mock_tool_manager = tool_setup["tm"]
+        mock_tool_manager.execute_tool_with_sources.side_effect = asyncio.CancelledError
+
+        mock_initial_response = spec_message
+        mock_initial_response.stop_reason = "tool_use"
+        mock_initial_response.content = [
+            spec_tool_use_block("search_course_content", "tool_1", {"query": "q"})
+        ]
+
+        with pytest.raises(asyncio.CancelledError):
+            await ai_gen._handle_tool_execution(
+                mock_initial_response, tool_setup["base"], mock_tool_manager
+            )
+        mock_anthropic_client.messages.create.assert_not_called()
+
+    async def test_response_cache_hit(self, mock_ai_generator, mock_anthropic_client):
+        """Test that identical requests are served from the response cache"""
+        mock_response = end_resp("Cached answer")
+        mock_anthropic_client.messages.create.return_value = mock_response
+
+        first = await mock_ai_generator.generate_response("What is AI?")
+        second = await mock_ai_generator.generate_response("  What is AI?  ")
+
+        assert first == second == "Cached answer"
+        assert mock_anthropic_client.messages.create.call_count == 1
+
+        # Different history changes the key
+        await mock_ai_generator.generate_response(
+            "What is AI?", conversation_history="User: hi"
+        )
+        assert mock_anthropic_client.messages.create.call_count == 2
+
+        # So does a different system prompt
+        mock_ai_generator.SYSTEM_PROMPT = "Answer in one word."
+        await mock_ai_generator.generate_response("What is AI?")
+        assert mock_anthropic_client.messages.create.call_count == 3
+
+    async def test_response_cache_restores_sources(
+        self, mock_ai_generator, mock_anthropic_client
+    ):
+        """Test that a cache hit returns the sources of the original answer"""
+        mock_tool_manager = Mock()
+        mock_tool_manager.execute_tool_with_sources.return_value = (
+            "Tool result content",
+            ["Test Course - Lesson 1"],
+        )
+
+        mock_tool_response = tool_use_resp(
+            "search_course_content", "tool_123", {"query": "test search"}
+        )
+
+        mock_final_response = end_resp("Answer from tools")
+        seed_responses(mock_anthropic_client, mock_tool_response, mock_final_response)
+
+        tools = [{"name": "search_course_content"}]
+        results = [
+            await mock_ai_generator.generate_response_with_sources(
+                "Search", tools=tools, tool_manager=mock_tool_manager
+            )
+            for _ in range(2)
+        ]
+
+        assert results == [("Answer from tools", ["Test Course - Lesson 1"])] * 2
+        assert mock_anthropic_client.messages.create.call_count == 2
+        mock_tool_manager.execute_tool_with_sources.assert_called_once()
+
+    async def test_response_cache_skips_errors_and_invalidates(
+        self, mock_ai_generator, mock_anthropic_client
+    ):
+        """Test that failed tool rounds are not cached and invalidate clears"""
+        mock_tool_manager = Mock()
+        mock_tool_manager.execute_tool_with_sources.return_value = (
+            "Tool result content",
+            [],
+        )
+
+        mock_tool_response = tool_use_resp(
+            "search_course_content", "tool_123", {"query": "test search"}
+        )
+        seed_responses(
+            mock_anthropic_client, mock_tool_response, Exception("API unavailable")
+        )
+
+        result = await mock_ai_generator.generate_response(
+            "Search", tools=[{"name": "search"}], tool_manager=mock_tool_manager
+        )
+        assert result.startswith(AIGenerator.TOOL_ROUND_ERROR)
+        assert mock_ai_generator._cache == {}
+
+        mock_response = end_resp("Direct answer")
+        mock_anthropic_client.messages.create.side_effect = None
+        mock_anthropic_client.messages.create.return_value = mock_response
+
+        await mock_ai_generator.generate_response("What is AI?")
+        mock_ai_generator.invalidate(model="other-model")
+        assert len(mock_ai_generator._cache) == 1
+        mock_ai_generator.invalidate(model="TEST-MODEL")
+        assert len(mock_ai_generator._cache) == 0
+
+    async def test_semantic_cache_serves_paraphrases(self, mock_anthropic_client):
+        """Test that near-duplicate standalone queries share a cached answer"""
+        vectors = {
+            "What is AI?": [1.0, 0.0, 0.0],
+            "Explain AI": [0.99, 0.05, 0.0],
+            "What is Python?": [0.0, 1.0, 0.0],
+        }
+        ai_gen = AIGenerator(
+            "test-key",
+            "test-model",
+            embedder=lambda texts: [vectors[text] for text in texts],
+            client=mock_anthropic_client,
+        )
+
+        mock_response = end_resp("AI answer")
+        mock_anthropic_client.messages.create.return_value = mock_response
+
+        await ai_gen.generate_response("What is AI?")
+        assert await ai_gen.generate_response("Explain AI") == "AI answer"
+        assert mock_anthropic_client.messages.create.call_count == 1
+
+        # Unrelated queries, history and the bypass token all reach Claude
+        await ai_gen.generate_response("What is Python?")
+        await ai_gen.generate_response("Explain AI", conversation_history="User: hi")
+        await ai_gen.generate_response("Explain AI !nocache")
+        assert mock_anthropic_client.messages.create.call_count == 4
+        last_call = mock_anthropic_client.messages.create.call_args[1]
+        assert last_call["messages"][0]["content"] == "Explain AI"
+
+        ai_gen.invalidate()
+        assert ai_gen._sem_entries == []
+        await ai_gen.generate_response("Explain AI")
+        assert mock_anthropic_client.messages.create.call_count == 5
+
+    async def test_semantic_cache_matches_raw_question_and_entities(
+        self, mock_anthropic_client
+    ):
+        """Test that hits use the raw question and require matching entities"""
+        embedded = []
+
+        def embedder(texts):
+            # Every question lands on the same vector; only entities differ
+            embedded.extend(texts)
+            return [[1.0, 0.0] for _ in texts]
+
+        ai_gen = AIGenerator(
+            "test-key", "test-model", embedder=embedder, client=mock_anthropic_client
+        )
+        mock_anthropic_client.messages.create.return_value = end_resp("Answer")
+
+        await ai_gen.generate_response(
+            "Answer this question about course materials: What is in lesson 3 of MCP?",
+            semantic_key="What is in lesson 3 of MCP?",
+        )
+        assert embedded == ["What is in lesson 3 of MCP?"]
+
+        # A different lesson number or course name is never served the answer
+        for question in ["What is in lesson 4 of MCP?", "What is in lesson 3 of RAG?"]:
+            await ai_gen.generate_response(question)
+        assert mock_anthropic_client.messages.create.call_count == 3
+
+        await ai_gen.generate_response("what's covered in lesson 3 of MCP")
+        assert mock_anthropic_client.messages.create.call_count == 3
+
+    def test_system_content_reused_for_same_history(self, mock_ai_generator):
+        """Test that system blocks are rebuilt only when history changes"""
+        first = mock_ai_generator._system_content("User: hi")
+        second = mock_ai_generator._system_content("User: hi")
+        third = mock_ai_generator._system_content(None)
+
+        assert first is second
+        assert third is not first
+        assert len(third) == 1
+        assert third[0]["text"] == mock_ai_generator.SYSTEM_PROMPT
+
+    def test_prepared_tools_reused_for_same_tools(self, mock_ai_generator):
+        """Test that cache-marked tools are rebuilt only when the tools change"""
+        tools = [{"name": "search_course_content"}]
+        first = mock_ai_generator._prepared_tools(tools)
+        second = mock_ai_generator._prepared_tools([{"name": "search_course_content"}])
+        third = mock_ai_generator._prepared_tools([{"name": "get_course_outline"}])
+
+        assert first is second
+        assert third is not first
+        assert third[-1]["name"] == "get_course_outline"
+        assert third[-1]["cache_control"] == {"type": "ephemeral"}
+
     def test_system_prompt_content(self):
         """Test that system prompt contains expected content"""
         assert "search_course_content" in AIGenerator.SYSTEM_PROMPT
@@ -276,29 +623,133 @@ class TestAIGenerator:
         assert "Sequential tool usage" in AIGenerator.SYSTEM_PROMPT
         assert "up to 2 rounds of tool calls" in AIGenerator.SYSTEM_PROMPT
         assert (
-            "tool_result" not in AIGenerator.SYSTEM_PROMPT.lower()
+            "tool_result" not in AIGenerator.SYSTEM_PROMPT_LOWER
         )  # No meta-commentary
         assert "Brief, Concise and focused" in AIGenerator.SYSTEM_PROMPT
 
-    @patch("anthropic.Anthropic")
-    def test_anthropic_client_initialization(self, mock_anthropic_class):
+    @patch("anthropic.AsyncAnthropic")
+    async def test_anthropic_client_initialization(self, mock_anthropic_class):
         """Test that Anthropic client is initialized correctly"""
         mock_client = Mock()
         mock_anthropic_class.return_value = mock_client
 
         ai_gen = AIGenerator("test-api-key", "test-model")
+        try:
+            assert mock_anthropic_class.call_count == 1
+            assert mock_anthropic_class.call_args.kwargs == {
+                "api_key": "test-api-key",
+                "http_client": ai_gen._http_client,
+                "max_retries": 0,
+            }
+            assert ai_gen.client == mock_client
+            assert ai_gen._http_client.timeout.connect == 5.0
+            # Connection retries are left to _with_retry alone
+            assert ai_gen._http_client._transport._pool._retries == 0
+        finally:
+            await ai_gen.aclose()
+
+        assert ai_gen._http_client.is_closed
+
+    async def test_rate_limited_calls_are_retried(
+        self, mock_ai_generator, mock_anthropic_client, monkeypatch
+    ):
+        """Test that 429/529 errors are retried, honoring retry-after"""
+        sleep = AsyncMock()
+        monkeypatch.setattr("ai_generator.asyncio.sleep", sleep)
+
+        rate_limited = Exception("Rate limited")
+        rate_limited.status_code = 429
+        rate_limited.response = Mock(headers={"retry-after": "7"})
+        overloaded = Exception("Overloaded")
+        overloaded.status_code = 529
+        overloaded.response = None
+
+        mock_response = end_resp("Answer after retries")
+        seed_responses(mock_anthropic_client, rate_limited, overloaded, mock_response)
+
+        result = await mock_ai_generator.generate_response("What is AI?")
+
+        assert result == "Answer after retries"
+        assert mock_anthropic_client.messages.create.call_count == 3
+        first_delay, second_delay = [c.args[0] for c in sleep.call_args_list]
+        assert first_delay == 7.0
+        assert 2 <= second_delay < 3
+
+    async def test_retry_gives_up_after_max_attempts(
+        self, mock_ai_generator, mock_anthropic_client, monkeypatch
+    ):
+        """Test that persistent or non-transient errors are raised"""
+        monkeypatch.setattr("ai_generator.asyncio.sleep", AsyncMock())
+
+        overloaded = Exception("Overloaded")
+        overloaded.status_code = 529
+        mock_anthropic_client.messages.create.side_effect = overloaded
+
+        with pytest.raises(Exception, match="Overloaded"):
+            await mock_ai_generator.generate_response("What is AI?")
+        assert (
+            mock_anthropic_client.messages.create.call_count == AIGenerator.MAX_ATTEMPTS
+        )
+
+        bad_request = Exception("Bad request")
+        bad_request.status_code = 400
+        mock_anthropic_client.messages.create.reset_mock()
+        mock_anthropic_client.messages.create.side_effect = bad_request
+
+        with pytest.raises(Exception, match="Bad request"):
+            await mock_ai_generator.generate_response("What is ML?")
+        assert mock_anthropic_client.messages.create.call_count == 1
+
+    @pytest.mark.parametrize("status_code", [408, 409, 500, 502])
+    async def test_transient_statuses_are_retried(
+        self, status_code, mock_ai_generator, mock_anthropic_client, monkeypatch
+    ):
+        """Test that the SDK's retryable statuses are retried as well"""
+        monkeypatch.setattr("ai_generator.asyncio.sleep", AsyncMock())
 
-        mock_anthropic_class.assert_called_once_with(api_key="test-api-key")
-        assert ai_gen.client == mock_client
+        transient = Exception("Transient")
+        transient.status_code = status_code
+        seed_responses(mock_anthropic_client, transient, end_resp("Recovered"))
 
-    def test_api_parameters_structure(self, mock_ai_generator, mock_anthropic_client):
+        assert await mock_ai_generator.generate_response("What is AI?") == "Recovered"
+        assert mock_anthropic_client.messages.create.call_count == 2
+
+    async def test_streamed_final_round_is_retried(self, tool_setup, monkeypatch):
+        """Test that a dropped connection on the streamed answer is retried"""
+        monkeypatch.setattr("ai_generator.asyncio.sleep", AsyncMock())
+        ai_gen = tool_setup["ai"]
+        mock_anthropic_client = tool_setup["client"]
+        mock_tool_manager = tool_setup["tm"]
+
+        mock_tool_manager.execute_tool_with_sources.return_value = ("Tool result", [])
+        seed_responses(
+            mock_anthropic_client,
+            tool_use_resp("search_course_content", "tool_2", {"query": "second"}),
+        )
+        dropped = anthropic.APIConnectionError(
+            request=httpx.Request("POST", "https://api.anthropic.com/v1/messages")
+        )
+        mock_anthropic_client.messages.stream = Mock(
+            side_effect=[dropped, FakeTextStream("Final ", "answer")]
+        )
+
+        result = await ai_gen._handle_tool_execution(
+            tool_use_resp("search_course_content", "tool_1", {"query": "first"}),
+            tool_setup["base"],
+            mock_tool_manager,
+        )
+
+        assert result == "Final answer"
+        assert mock_anthropic_client.messages.stream.call_count == 2
+
+    async def test_api_parameters_structure(
+        self, mock_ai_generator, mock_anthropic_client
+    ):
         """Test that API parameters are structured correctly"""
-        mock_response = Mock()
-        mock_response.stop_reason = "end_turn"
-        mock_response.content = [Mock(text="Test response")]
+        mock_response = end_resp("Test response")
         mock_anthropic_client.messages.create.return_value = mock_response
 
-        mock_ai_generator.generate_response(
+        await mock_ai_generator.generate_response(
             "Test query",
             conversation_history="Previous context",
             tools=[{"name": "test_tool"}],
@@ -320,154 +771,55 @@ class TestAIGenerator:
         assert call_args["max_tokens"] == 800
         assert call_args["tool_choice"] == {"type": "auto"}
 
-    def test_error_handling_missing_tool_manager(
+        # System prompt goes out as a cacheable block list, history last
+        assert call_args["system"][0] == {
+            "type": "text",
+            "text": mock_ai_generator.SYSTEM_PROMPT,
+            "cache_control": {"type": "ephemeral"},
+        }
+        assert call_args["system"][-1]["text"].endswith("Previous context")
+
+    async def test_error_handling_missing_tool_manager(
         self, mock_ai_generator, mock_anthropic_client
     ):
         """Test handling when tool_use response received but no tool_manager provided"""
         mock_response = Mock()
         mock_response.stop_reason = "tool_use"
-        mock_response.content = [Mock(text="Tool use attempt")]
+        mock_response.content = [TextBlock("Tool use attempt")]
         mock_anthropic_client.messages.create.return_value = mock_response
 
         # This should not crash, just return the content directly
-        result = mock_ai_generator.generate_response(
+        result = await mock_ai_generator.generate_response(
             "Test query", tools=[{"name": "test_tool"}], tool_manager=None
         )
 
         # Should return content directly since no tool_manager provided
         assert result == "Tool use attempt"
 
-    def test_sequential_tool_calling_two_rounds(self):
-        """Test sequential tool calling with two rounds"""
-        # Create fresh mocks for this test
-        mock_anthropic_client = Mock()
-        ai_gen = AIGenerator("test-key", "test-model")
-        ai_gen.client = mock_anthropic_client
-
-        # Create mock tool manager
+    async def test_oversized_tool_results_truncated_and_end_rounds(
+        self,
+        mock_ai_generator,
+        mock_anthropic_client,
+        spec_message,
+        spec_tool_use_block,
+    ):
+        """Test that large tool results are clipped and force a final answer"""
         mock_tool_manager = Mock()
-        mock_tool_manager.execute_tool.side_effect = [
-            "Course found: Machine Learning Basics",
-            "Related courses: Advanced ML, Deep Learning",
-        ]
+        mock_tool_manager.execute_tool_with_sources.return_value = ("x" * 40_000, [])
 
-        # First response: first tool use
-        mock_first_response = Mock()
-        mock_first_response.stop_reason = "tool_use"
-        mock_first_content_block = Mock()
-        mock_first_content_block.type = "tool_use"
-        mock_first_content_block.name = "get_course_outline"
-        mock_first_content_block.id = "tool_round_1"
-        mock_first_content_block.input = {"course_name": "ML Course"}
-        mock_first_response.content = [mock_first_content_block]
-
-        # Second response: second tool use
-        mock_second_response = Mock()
-        mock_second_response.stop_reason = "tool_use"
-        mock_second_content_block = Mock()
-        mock_second_content_block.type = "tool_use"
-        mock_second_content_block.name = "search_course_content"
-        mock_second_content_block.id = "tool_round_2"
-        mock_second_content_block.input = {
-            "query": "machine learning",
-            "course_name": "ML Course",
-        }
-        mock_second_response.content = [mock_second_content_block]
-
-        # Final response: answer after two rounds
-        mock_final_response = Mock()
-        mock_final_response.stop_reason = "end_turn"
-        mock_final_response.content = [
-            Mock(text="Based on both tool results, here's your answer")
-        ]
-
-        # Configure mock to return responses in sequence
-        # Note: the first response is already passed to _handle_tool_execution
-        mock_anthropic_client.messages.create.side_effect = [
-            mock_second_response,
-            mock_final_response,
+        mock_response = spec_message
+        mock_response.stop_reason = "tool_use"
+        mock_response.content = [
+            spec_tool_use_block(
+                "search_course_content", f"tool_{i}", {"query": f"search {i}"}
+            )
+            for i in range(4)
         ]
 
-        base_params = {
-            "model": "test-model",
-            "messages": [
-                {"role": "user", "content": "Find ML course and related content"}
-            ],
-            "system": "Test system prompt",
-            "tools": [
-                {"name": "get_course_outline"},
-                {"name": "search_course_content"},
-            ],
-        }
-
-        result = ai_gen._handle_tool_execution(
-            mock_first_response, base_params, mock_tool_manager
+        mock_anthropic_client.messages.stream = Mock(
+            return_value=FakeTextStream("Answer from clipped results")
         )
 
-        # Verify both tools were executed in sequence
-        assert mock_tool_manager.execute_tool.call_count == 2
-
-        # Verify three API calls were made (initial tool use, second tool use, final response)
-        assert mock_anthropic_client.messages.create.call_count == 2
-
-        # Verify first tool call
-        first_call = mock_tool_manager.execute_tool.call_args_list[0]
-        assert first_call[0][0] == "get_course_outline"
-        assert first_call[1]["course_name"] == "ML Course"
-
-        # Verify second tool call
-        second_call = mock_tool_manager.execute_tool.call_args_list[1]
-        assert second_call[0][0] == "search_course_content"
-        assert second_call[1]["query"] == "machine learning"
-
-        # Verify final result
-        assert result == "Based on both tool results, here's your answer"
-
-    def test_sequential_tool_calling_max_rounds_exceeded(self):
-        """Test that sequential tool calling stops at max rounds"""
-        # Create fresh mocks for this test
-        mock_anthropic_client = Mock()
-        ai_gen = AIGenerator("test-key", "test-model")
-        ai_gen.client = mock_anthropic_client
-
-        # Create mock tool manager
-        mock_tool_manager = Mock()
-        mock_tool_manager.execute_tool.side_effect = [
-            "First tool result",
-            "Second tool result",
-        ]
-
-        # First response: tool use
-        mock_first_response = Mock()
-        mock_first_response.stop_reason = "tool_use"
-        mock_first_content_block = Mock()
-        mock_first_content_block.type = "tool_use"
-        mock_first_content_block.name = "search_course_content"
-        mock_first_content_block.id = "tool_1"
-        mock_first_content_block.input = {"query": "first search"}
-        mock_first_response.content = [mock_first_content_block]
-
-        # Second response: tool use (should be the last round)
-        mock_second_response = Mock()
-        mock_second_response.stop_reason = "tool_use"
-        mock_second_content_block = Mock()
-        mock_second_content_block.type = "tool_use"
-        mock_second_content_block.name = "search_course_content"
-        mock_second_content_block.id = "tool_2"
-        mock_second_content_block.input = {"query": "second search"}
-        mock_second_response.content = [mock_second_content_block]
-
-        # Third response: would be tool use but should not happen due to max rounds
-        mock_third_response = Mock()
-        mock_third_response.stop_reason = "tool_use"
-        mock_third_response.content = [Mock(text="Should not reach here")]
-
-        # Configure mock to return responses - only first two should be called
-        mock_anthropic_client.messages.create.side_effect = [
-            mock_second_response,
-            mock_third_response,
-        ]
-
         base_params = {
             "model": "test-model",
             "messages": [{"role": "user", "content": "Test query"}],
@@ -475,124 +827,113 @@ class TestAIGenerator:
             "tools": [{"name": "search_course_content"}],
         }
 
-        result = ai_gen._handle_tool_execution(
-            mock_first_response, base_params, mock_tool_manager
+        result = await mock_ai_generator._handle_tool_execution(
+            mock_response, base_params, mock_tool_manager
         )
 
-        # Verify only 2 tools were executed (max rounds)
-        assert mock_tool_manager.execute_tool.call_count == 2
-
-        # Verify only 2 API calls were made (not 3)
-        assert mock_anthropic_client.messages.create.call_count == 2
-
-        # Should return the last response content even if it wanted more tools
-        assert "Should not reach here" in result
-
-    def test_sequential_tool_calling_with_error_in_second_round(self):
-        """Test sequential tool calling with error in second round"""
-        # Create fresh mocks for this test
-        mock_anthropic_client = Mock()
-        ai_gen = AIGenerator("test-key", "test-model")
-        ai_gen.client = mock_anthropic_client
-
-        # Create mock tool manager with error on second call
-        mock_tool_manager = Mock()
-        mock_tool_manager.execute_tool.side_effect = [
-            "First tool result",
-            Exception("Tool execution failed"),
-        ]
-
-        # First response: tool use
-        mock_first_response = Mock()
-        mock_first_response.stop_reason = "tool_use"
-        mock_first_content_block = Mock()
-        mock_first_content_block.type = "tool_use"
-        mock_first_content_block.name = "search_course_content"
-        mock_first_content_block.id = "tool_1"
-        mock_first_content_block.input = {"query": "first search"}
-        mock_first_response.content = [mock_first_content_block]
-
-        # Second response: tool use
-        mock_second_response = Mock()
-        mock_second_response.stop_reason = "tool_use"
-        mock_second_content_block = Mock()
-        mock_second_content_block.type = "tool_use"
-        mock_second_content_block.name = "search_course_content"
-        mock_second_content_block.id = "tool_2"
-        mock_second_content_block.input = {"query": "second search"}
-        mock_second_response.content = [mock_second_content_block]
-
-        # Final response: answer with error handling
-        mock_final_response = Mock()
-        mock_final_response.stop_reason = "end_turn"
-        mock_final_response.content = [Mock(text="Response with error handled")]
-
-        mock_anthropic_client.messages.create.side_effect = [
-            mock_second_response,
-            mock_final_response,
+        # Four clipped results exceed the cumulative cap after one round
+        mock_anthropic_client.messages.create.assert_not_called()
+        stream_args = mock_anthropic_client.messages.stream.call_args[1]
+        assert stream_args["tools"] == base_params["tools"]
+        assert stream_args["tool_choice"] == {"type": "none"}
+        tool_results = stream_args["messages"][2]["content"]
+        cap = AIGenerator.MAX_TOOL_RESULT_CHARS
+        assert all(
+            len(r["content"]) == cap + len("...[truncated]") for r in tool_results
+        )
+        assert result == "Answer from clipped results"
+
+    @pytest.mark.parametrize("scenario", list(SEQUENTIAL_SCENARIOS))
+    async def test_sequential_tool_calling(self, scenario, tool_setup):
+        """Test sequential tool rounds end on end_turn, max rounds or errors"""
+        cfg = SEQUENTIAL_SCENARIOS[scenario]
+        ai_gen = tool_setup["ai"]
+        mock_anthropic_client = tool_setup["client"]
+        mock_tool_manager = tool_setup["tm"]
+
+        mock_tool_manager.execute_tool_with_sources.side_effect = [
+            effect if isinstance(effect, Exception) else (effect, [])
+            for effect in cfg["tool_effects"]
         ]
+        seed_responses(mock_anthropic_client, *cfg["responses"])
+        mock_anthropic_client.messages.stream = Mock(
+            return_value=FakeTextStream(*cfg["stream_chunks"])
+        )
 
-        base_params = {
-            "model": "test-model",
-            "messages": [{"role": "user", "content": "Test query"}],
-            "system": "Test system prompt",
-            "tools": [{"name": "search_course_content"}],
-        }
-
-        result = ai_gen._handle_tool_execution(
-            mock_first_response, base_params, mock_tool_manager
+        result = await ai_gen._handle_tool_execution(
+            cfg["first"], tool_setup["base"], mock_tool_manager
         )
 
-        # Verify both tools were attempted
-        assert mock_tool_manager.execute_tool.call_count == 2
+        # Tools ran in order with the arguments Claude asked for
+        tool_calls = mock_tool_manager.execute_tool_with_sources.call_args_list
+        assert [(c.args[0], c.kwargs) for c in tool_calls] == cfg["tool_calls"]
+        assert mock_anthropic_client.messages.create.call_count == len(cfg["responses"])
+
+        # Reaching max rounds forbids tool use and streams the final answer
+        if cfg["stream_chunks"]:
+            create_kwargs = mock_anthropic_client.messages.create.call_args.kwargs
+            stream_kwargs = mock_anthropic_client.messages.stream.call_args.kwargs
+            assert stream_kwargs["tools"] == create_kwargs["tools"]
+            assert create_kwargs["tool_choice"] == {"type": "auto"}
+            assert stream_kwargs["tool_choice"] == {"type": "none"}
+        else:
+            mock_anthropic_client.messages.stream.assert_not_called()
+
+        assert result == cfg["result"]
+
+    async def test_tool_rounds_grow_one_messages_list(self, tool_setup):
+        """Test that every round sends the same messages list, appended in place"""
+        ai_gen = tool_setup["ai"]
+        mock_anthropic_client = tool_setup["client"]
+        mock_tool_manager = tool_setup["tm"]
+        base_params = tool_setup["base"]
+        messages = base_params["messages"]
+
+        mock_tool_manager.execute_tool_with_sources.return_value = ("Tool result", [])
+        seed_responses(
+            mock_anthropic_client,
+            tool_use_resp("search_course_content", "tool_2", {"query": "second"}),
+        )
+        mock_anthropic_client.messages.stream = Mock(
+            return_value=FakeTextStream("Final answer")
+        )
 
-        # Verify that the error was handled gracefully
-        assert result == "Response with error handled"
+        await ai_gen._handle_tool_execution(
+            tool_use_resp("search_course_content", "tool_1", {"query": "first"}),
+            base_params,
+            mock_tool_manager,
+        )
 
-    def test_sequential_tool_calling_early_termination(self):
-        """Test sequential tool calling that terminates early when no more tools needed"""
-        # Create fresh mocks for this test
-        mock_anthropic_client = Mock()
-        ai_gen = AIGenerator("test-key", "test-model")
-        ai_gen.client = mock_anthropic_client
+        create_kwargs = mock_anthropic_client.messages.create.call_args.kwargs
+        stream_kwargs = mock_anthropic_client.messages.stream.call_args.kwargs
+        assert create_kwargs["messages"] is messages
+        assert stream_kwargs["messages"] is messages
+        assert [m["role"] for m in messages] == [
+            "user",
+            "assistant",
+            "user",
+            "assistant",
+            "user",
+        ]
 
-        # Create mock tool manager
-        mock_tool_manager = Mock()
-        mock_tool_manager.execute_tool.return_value = "Tool result"
+    async def test_tool_use_stop_without_tool_use_blocks(self, tool_setup):
+        """Test that a tool_use stop with no tool_use blocks skips another round"""
+        ai_gen = tool_setup["ai"]
+        mock_anthropic_client = tool_setup["client"]
+        mock_tool_manager = tool_setup["tm"]
 
-        # First response: tool use
-        mock_first_response = Mock()
-        mock_first_response.stop_reason = "tool_use"
-        mock_first_content_block = Mock()
-        mock_first_content_block.type = "tool_use"
-        mock_first_content_block.name = "search_course_content"
-        mock_first_content_block.id = "tool_1"
-        mock_first_content_block.input = {"query": "search"}
-        mock_first_response.content = [mock_first_content_block]
-
-        # Second response: no more tool use, direct answer
-        mock_second_response = Mock()
-        mock_second_response.stop_reason = "end_turn"
-        mock_second_response.content = [Mock(text="Final answer after one tool use")]
-
-        mock_anthropic_client.messages.create.side_effect = [mock_second_response]
+        # Response claims tool use but only carries text
+        mock_response = Mock()
+        mock_response.stop_reason = "tool_use"
+        mock_response.content = [TextBlock("Answer without tools")]
 
-        base_params = {
-            "model": "test-model",
-            "messages": [{"role": "user", "content": "Test query"}],
-            "system": "Test system prompt",
-            "tools": [{"name": "search_course_content"}],
-        }
+        base_params = tool_setup["base"]
 
-        result = ai_gen._handle_tool_execution(
-            mock_first_response, base_params, mock_tool_manager
+        result = await ai_gen._handle_tool_execution(
+            mock_response, base_params, mock_tool_manager
         )
 
-        # Verify only one tool was executed
-        assert mock_tool_manager.execute_tool.call_count == 1
-
-        # Verify only one API call was made (since second response was end_turn)
-        assert mock_anthropic_client.messages.create.call_count == 1
-
-        # Verify correct termination
-        assert result == "Final answer after one tool use"
+        # No tools run and no follow-up API call is made
+        mock_tool_manager.execute_tool_with_sources.assert_not_called()
+        mock_anthropic_client.messages.create.assert_not_called()
+        assert result == "Answer without tools"
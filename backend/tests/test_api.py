@@ -1,7 +1,32 @@
+import anthropic
+import httpx
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import Mock
 import json
+from .conftest import COURSES_RESPONSE, QUERY_RESPONSE, SESSION_RESPONSE
+
+# Request bodies are serialized once at import and sent as raw bytes
+JSON_HEADERS = {"Content-Type": "application/json"}
+QUERY_WITH_SESSION = json.dumps(
+    {"query": "What is the course about?", "session_id": "existing-session-123"}
+).encode()
+QUERY_WITHOUT_SESSION = json.dumps({"query": "Tell me about machine learning"}).encode()
+EMPTY_QUERY = json.dumps({"query": ""}).encode()
+MISSING_QUERY = json.dumps({"session_id": "test-123"}).encode()
+ERROR_QUERY = json.dumps({"query": "What is this about?"}).encode()
+EXTRA_FIELDS_QUERY = json.dumps(
+    {"query": "Test query", "session_id": "test-123", "extra_field": "should be ignored"}
+).encode()
+FORMAT_QUERY = json.dumps({"query": "test"}).encode()
+
+
+@pytest.fixture(autouse=True)
+def _reset_mock_rag_system(mock_rag_system):
+    """Clear calls and injected errors on the session-wide mock RAG system"""
+    yield
+    # Side effects are reset on child mocks too; default return values stay
+    mock_rag_system.reset_mock(side_effect=True)
 
 
 @pytest.mark.api
@@ -16,36 +41,28 @@ class TestAPIEndpoints:
     
     def test_query_endpoint_with_session_id(self, test_client, mock_rag_system):
         """Test /api/query endpoint with provided session ID"""
-        query_data = {
-            "query": "What is the course about?",
-            "session_id": "existing-session-123"
-        }
-        
-        response = test_client.post("/api/query", json=query_data)
+        response = test_client.post(
+            "/api/query", content=QUERY_WITH_SESSION, headers=JSON_HEADERS
+        )
         
         assert response.status_code == 200
-        data = response.json()
-        assert "answer" in data
-        assert "sources" in data
-        assert "session_id" in data
-        assert data["session_id"] == "existing-session-123"
-        assert data["answer"] == "This is a test response about the course materials."
-        assert data["sources"] == ["Test Course - Lesson 1", "Test Course - Lesson 2"]
+        data = QUERY_RESPONSE.validate_json(response.content)
+        assert data.session_id == "existing-session-123"
+        assert data.answer == "This is a test response about the course materials."
+        assert data.sources == ["Test Course - Lesson 1", "Test Course - Lesson 2"]
         
         # Verify RAG system was called correctly
         mock_rag_system.query.assert_called_once_with("What is the course about?", "existing-session-123")
     
     def test_query_endpoint_without_session_id(self, test_client, mock_rag_system):
         """Test /api/query endpoint creates new session when not provided"""
-        query_data = {
-            "query": "Tell me about machine learning"
-        }
-        
-        response = test_client.post("/api/query", json=query_data)
+        response = test_client.post(
+            "/api/query", content=QUERY_WITHOUT_SESSION, headers=JSON_HEADERS
+        )
         
         assert response.status_code == 200
-        data = response.json()
-        assert data["session_id"] == "test-session-123"
+        data = QUERY_RESPONSE.validate_json(response.content)
+        assert data.session_id == "test-session-123"
         
         # Verify session creation was called
         mock_rag_system.session_manager.create_session.assert_called_once()
@@ -53,18 +70,18 @@ class TestAPIEndpoints:
     
     def test_query_endpoint_empty_query(self, test_client):
         """Test /api/query endpoint with empty query"""
-        query_data = {"query": ""}
-        
-        response = test_client.post("/api/query", json=query_data)
+        response = test_client.post(
+            "/api/query", content=EMPTY_QUERY, headers=JSON_HEADERS
+        )
         
         # Should still work - empty queries are handled by the RAG system
         assert response.status_code == 200
     
     def test_query_endpoint_missing_query(self, test_client):
         """Test /api/query endpoint with missing query field"""
-        query_data = {"session_id": "test-123"}
-        
-        response = test_client.post("/api/query", json=query_data)
+        response = test_client.post(
+            "/api/query", content=MISSING_QUERY, headers=JSON_HEADERS
+        )
         
         # Should return validation error
         assert response.status_code == 422
@@ -73,23 +90,37 @@ class TestAPIEndpoints:
         """Test /api/query endpoint when RAG system raises exception"""
         mock_rag_system.query.side_effect = Exception("RAG system error")
         
-        query_data = {"query": "What is this about?"}
-        
-        response = test_client.post("/api/query", json=query_data)
+        response = test_client.post(
+            "/api/query", content=ERROR_QUERY, headers=JSON_HEADERS
+        )
         
         assert response.status_code == 500
         assert "RAG system error" in response.json()["detail"]
     
+    def test_query_endpoint_overloaded_error(self, test_client, mock_rag_system):
+        """Test /api/query endpoint maps an overloaded Claude API to 503"""
+        request = httpx.Request("POST", "https://api.anthropic.com/v1/messages")
+        mock_rag_system.query.side_effect = anthropic.InternalServerError(
+            message="Overloaded",
+            response=httpx.Response(529, request=request),
+            body=None,
+        )
+        
+        response = test_client.post(
+            "/api/query", content=ERROR_QUERY, headers=JSON_HEADERS
+        )
+        
+        assert response.status_code == 503
+        assert "Overloaded" in response.json()["detail"]
+    
     def test_courses_endpoint_success(self, test_client, mock_rag_system):
         """Test /api/courses endpoint returns course statistics"""
         response = test_client.get("/api/courses")
         
         assert response.status_code == 200
-        data = response.json()
-        assert "total_courses" in data
-        assert "course_titles" in data
-        assert data["total_courses"] == 1
-        assert data["course_titles"] == ["Test Course"]
+        data = COURSES_RESPONSE.validate_json(response.content)
+        assert data.total_courses == 1
+        assert data.course_titles == ["Test Course"]
         
         # Verify analytics was called
         mock_rag_system.get_course_analytics.assert_called_once()
@@ -108,9 +139,8 @@ class TestAPIEndpoints:
         response = test_client.post("/api/session/new")
         
         assert response.status_code == 200
-        data = response.json()
-        assert "session_id" in data
-        assert data["session_id"] == "test-session-123"
+        data = SESSION_RESPONSE.validate_json(response.content)
+        assert data.session_id == "test-session-123"
         
         # Verify session creation was called
         mock_rag_system.session_manager.create_session.assert_called_once()
@@ -125,109 +155,74 @@ class TestAPIEndpoints:
         assert "Session creation failed" in response.json()["detail"]
 
 
-@pytest.mark.api 
-class TestAPIRequestValidation:
-    """Test suite for API request validation"""
-    
-    def test_query_endpoint_invalid_json(self, test_client):
-        """Test /api/query endpoint with invalid JSON"""
-        response = test_client.post(
-            "/api/query", 
-            data="invalid json",
-            headers={"Content-Type": "application/json"}
-        )
-        
-        assert response.status_code == 422
-    
-    def test_query_endpoint_wrong_content_type(self, test_client):
-        """Test /api/query endpoint with wrong content type"""
-        response = test_client.post(
-            "/api/query",
-            data="query=test",
-            headers={"Content-Type": "application/x-www-form-urlencoded"}
-        )
-        
-        assert response.status_code == 422
-    
-    def test_query_endpoint_extra_fields(self, test_client):
-        """Test /api/query endpoint ignores extra fields"""
-        query_data = {
-            "query": "Test query",
-            "session_id": "test-123",
-            "extra_field": "should be ignored"
-        }
-        
-        response = test_client.post("/api/query", json=query_data)
-        
-        # Should succeed and ignore extra field
-        assert response.status_code == 200
+@pytest.mark.api
+class TestAPIRequestHandling:
+    """Test suite for request validation and CORS handling"""
+    
+    @pytest.mark.parametrize(
+        "method,path,kwargs,expected",
+        [
+            (
+                "POST",
+                "/api/query",
+                {"content": b"invalid json", "headers": JSON_HEADERS},
+                {422},
+            ),
+            (
+                "POST",
+                "/api/query",
+                {
+                    "content": b"query=test",
+                    "headers": {"Content-Type": "application/x-www-form-urlencoded"},
+                },
+                {422},
+            ),
+            # Extra fields are ignored
+            (
+                "POST",
+                "/api/query",
+                {"content": EXTRA_FIELDS_QUERY, "headers": JSON_HEADERS},
+                {200},
+            ),
+            # CORS headers may be omitted, but the request must succeed
+            ("GET", "/", {"headers": {"Origin": "http://localhost:3000"}}, {200}),
+            # FastAPI may answer a bare preflight with 405
+            ("OPTIONS", "/api/query", {}, {200, 405}),
+        ],
+        ids=[
+            "invalid_json",
+            "wrong_content_type",
+            "extra_fields",
+            "cors_origin",
+            "options",
+        ],
+    )
+    def test_request_handling(self, test_client, method, path, kwargs, expected):
+        """Test status codes for malformed, extra-field and cross-origin requests"""
+        response = test_client.request(method, path, **kwargs)
+        
+        assert response.status_code in expected
 
 
 @pytest.mark.api
 class TestAPIResponseFormats:
     """Test suite for API response formats"""
     
-    def test_query_response_format(self, test_client):
-        """Test /api/query response has correct format"""
-        query_data = {"query": "test"}
-        
-        response = test_client.post("/api/query", json=query_data)
-        
-        assert response.status_code == 200
-        data = response.json()
-        
-        # Check required fields
-        assert isinstance(data["answer"], str)
-        assert isinstance(data["sources"], list)
-        assert isinstance(data["session_id"], str)
-        
-        # Check field values
-        assert len(data["answer"]) > 0
-        assert len(data["session_id"]) > 0
-    
-    def test_courses_response_format(self, test_client):
-        """Test /api/courses response has correct format"""
-        response = test_client.get("/api/courses")
-        
-        assert response.status_code == 200
-        data = response.json()
-        
-        # Check required fields
-        assert isinstance(data["total_courses"], int)
-        assert isinstance(data["course_titles"], list)
-        
-        # Check field values
-        assert data["total_courses"] >= 0
-        assert all(isinstance(title, str) for title in data["course_titles"])
-    
-    def test_session_response_format(self, test_client):
-        """Test /api/session/new response has correct format"""
-        response = test_client.post("/api/session/new")
-        
-        assert response.status_code == 200
-        data = response.json()
-        
-        # Check required fields
-        assert isinstance(data["session_id"], str)
-        assert len(data["session_id"]) > 0
-
-
-@pytest.mark.api
-class TestAPICORS:
-    """Test suite for CORS middleware"""
-    
-    def test_cors_headers_present(self, test_client):
-        """Test that CORS headers are present in responses"""
-        # Make a request that would trigger CORS headers (with Origin header)
-        response = test_client.get("/", headers={"Origin": "http://localhost:3000"})
+    @pytest.mark.parametrize(
+        "method,path,body,adapter",
+        [
+            ("POST", "/api/query", FORMAT_QUERY, QUERY_RESPONSE),
+            ("GET", "/api/courses", None, COURSES_RESPONSE),
+            ("POST", "/api/session/new", None, SESSION_RESPONSE),
+        ],
+        ids=["query", "courses", "session"],
+    )
+    def test_response_format(self, test_client, method, path, body, adapter):
+        """Test each endpoint's JSON body against its expected shape"""
+        response = test_client.request(
+            method, path, content=body, headers=JSON_HEADERS
+        )
         
-        # CORS headers may not be present for same-origin requests
-        # Let's just check the response is successful
         assert response.status_code == 200
-    
-    def test_options_request(self, test_client):
-        """Test OPTIONS request for CORS preflight"""
-        response = test_client.options("/api/query")
-        
-        # Should handle OPTIONS requests
-        assert response.status_code in [200, 405]  # 405 is also acceptable for FastAPI
\ No newline at end of file
+        # Raises ValidationError on a missing field, wrong type or empty value
+        adapter.validate_json(response.content)
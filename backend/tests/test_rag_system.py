@@ -1,23 +1,53 @@
+import asyncio
 import os
 import shutil
-import sys
 import tempfile
-from unittest.mock import MagicMock, Mock, patch
+from unittest.mock import MagicMock, Mock
 
 import pytest
+from models import Course, CourseChunk, Lesson
 
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from .conftest import FAKE_ANSWER, end_resp, seed_responses, tool_use_resp
 
-from models import Course, CourseChunk, Lesson
-from rag_system import RAGSystem
+PROGRAMMING_COURSE_TEXT = """Course Title: Programming Fundamentals
+Course Link: http://example.com/programming
+Course Instructor: Jane Doe
+
+Lesson 1: Python Basics
+Lesson Link: http://example.com/programming/lesson1
+Python is a high-level programming language. It is widely used for web development, data analysis, and machine learning.
+
+Lesson 2: Data Structures
+Lesson Link: http://example.com/programming/lesson2
+Data structures are ways of organizing data. Common types include lists, dictionaries, and sets."""
+
+ANALYTICS_COURSE_TEXT = """Course Title: Analytics Test Course
+Course Link: http://example.com
+Course Instructor: Test Instructor
+
+Lesson 1: Introduction
+Content here."""
+
+
+@pytest.fixture(autouse=True)
+def _reset_rag_system(rag_system, fake_anthropic):
+    """Wipe documents, sessions, cached answers and canned API
+    responses after each test"""
+    yield
+    create = fake_anthropic.messages.create
+    create.reset_mock(side_effect=True)
+    create.return_value = end_resp(FAKE_ANSWER)
+    rag_system.vector_store.clear_all_data()
+    rag_system.session_manager.sessions.clear()
+    rag_system.ai_generator.invalidate()
 
 
 class TestRAGSystemInitialization:
     """Test RAG system initialization and component setup"""
 
-    def test_init_components(self, test_config):
+    def test_init_components(self, fresh_rag_system):
         """Test that all components are properly initialized"""
-        rag = RAGSystem(test_config)
+        rag = fresh_rag_system
 
         # Verify all components exist
         assert rag.document_processor is not None
@@ -32,9 +62,9 @@ class TestRAGSystemInitialization:
         assert "search_course_content" in rag.tool_manager.tools
         assert "get_course_outline" in rag.tool_manager.tools
 
-    def test_config_propagation(self, test_config):
+    def test_config_propagation(self, fresh_rag_system, test_config):
         """Test that configuration is properly propagated to components"""
-        rag = RAGSystem(test_config)
+        rag = fresh_rag_system
 
         # Check document processor config
         assert rag.document_processor.chunk_size == test_config.CHUNK_SIZE
@@ -46,11 +76,27 @@ class TestRAGSystemInitialization:
         # Check session manager config
         assert rag.session_manager.max_history == test_config.MAX_HISTORY
 
+    def test_semantic_cache_is_opt_in(self, test_config, fake_anthropic):
+        """Test that the semantic cache only gets an embedder when enabled"""
+        from dataclasses import replace
+
+        from rag_system import RAGSystem
+
+        rag = RAGSystem(test_config, ai_client=fake_anthropic)
+        rag.vector_store.close()
+        assert rag.ai_generator._embedder is None
+
+        enabled = replace(test_config, SEMANTIC_CACHE_ENABLED=True)
+        rag = RAGSystem(enabled, ai_client=fake_anthropic)
+        rag.vector_store.close()
+        assert rag.ai_generator._embedder is rag.vector_store.embedding_function
+        assert rag.ai_generator._sem_threshold == enabled.SEMANTIC_CACHE_THRESHOLD
+
 
 class TestRAGSystemDocumentProcessing:
     """Test document processing functionality"""
 
-    def test_add_course_document_success(self, test_config, temp_dir):
+    def test_add_course_document_success(self, rag_system, temp_dir):
         """Test successful course document addition"""
         # Create a test document
         test_file = os.path.join(temp_dir, "test_course.txt")
@@ -69,8 +115,7 @@ Lesson Link: http://example.com/lesson2
 This is the content of lesson 2."""
             )
 
-        rag = RAGSystem(test_config)
-        course, chunk_count = rag.add_course_document(test_file)
+        course, chunk_count = rag_system.add_course_document(test_file)
 
         assert course is not None
         assert course.title == "Test Course"
@@ -78,19 +123,22 @@ This is the content of lesson 2."""
         assert len(course.lessons) == 2
         assert chunk_count > 0
 
-    def test_add_course_document_file_not_found(self, test_config):
+    def test_add_course_document_file_not_found(self, rag_system):
         """Test handling of non-existent files"""
-        rag = RAGSystem(test_config)
-        course, chunk_count = rag.add_course_document("/nonexistent/file.txt")
+        course, chunk_count = rag_system.add_course_document("/nonexistent/file.txt")
 
         assert course is None
         assert chunk_count == 0
 
-    def test_add_course_folder_success(self, test_config, temp_dir):
+    def test_add_course_folder_success(self, rag_system, temp_dir):
         """Test adding multiple courses from folder"""
+        # Own subdirectory, since temp_dir is shared across the class
+        folder = os.path.join(temp_dir, "folder_success")
+        os.mkdir(folder)
+
         # Create test documents
         for i in range(2):
-            test_file = os.path.join(temp_dir, f"course{i+1}.txt")
+            test_file = os.path.join(folder, f"course{i+1}.txt")
             with open(test_file, "w") as f:
                 f.write(
                     f"""Course Title: Test Course {i+1}
@@ -102,202 +150,244 @@ Lesson Link: http://example.com/course{i+1}/lesson1
 This is the content of course {i+1} lesson 1."""
                 )
 
-        rag = RAGSystem(test_config)
-        total_courses, total_chunks = rag.add_course_folder(temp_dir)
+        total_courses, total_chunks = rag_system.add_course_folder(folder)
 
         assert total_courses == 2
         assert total_chunks > 0
 
-    def test_add_course_folder_nonexistent(self, test_config):
+    def test_add_course_documents_single_batch(self, rag_system, temp_dir, monkeypatch):
+        """Test that several documents are written to the store in one batch"""
+        paths = []
+        for i in range(3):
+            path = os.path.join(temp_dir, f"batch{i}.txt")
+            with open(path, "w") as f:
+                f.write(
+                    f"Course Title: Batch Course {i}\n"
+                    f"Course Link: http://example.com/batch{i}\n"
+                    "Course Instructor: Test Instructor\n\n"
+                    f"Lesson 1: Intro\nBatch course {i} content."
+                )
+            paths.append(path)
+        # A repeated document is skipped rather than written twice
+        paths.append(paths[0])
+
+        store = rag_system.vector_store
+        add_content = Mock(wraps=store.add_course_content)
+        monkeypatch.setattr(store, "add_course_content", add_content)
+
+        total_courses, total_chunks = rag_system.add_course_documents(paths)
+
+        assert total_courses == 3
+        assert add_content.call_count == 1
+        assert len(add_content.call_args.args[0]) == total_chunks
+        assert store.get_course_count() == 3
+
+    def test_add_course_documents_store_failure(
+        self, rag_system, temp_dir, monkeypatch, capsys
+    ):
+        """Test that a failed batch write is reported instead of raised"""
+        path = os.path.join(temp_dir, "failing.txt")
+        with open(path, "w") as f:
+            f.write(ANALYTICS_COURSE_TEXT)
+
+        monkeypatch.setattr(
+            rag_system.vector_store,
+            "add_course_content",
+            Mock(side_effect=RuntimeError("disk full")),
+        )
+
+        assert rag_system.add_course_documents([path]) == (0, 0)
+
+        output = capsys.readouterr().out
+        assert "Error adding courses Analytics Test Course: disk full" in output
+        assert "Added new course" not in output
+
+    def test_add_course_folder_nonexistent(self, rag_system):
         """Test handling of non-existent folder"""
-        rag = RAGSystem(test_config)
-        total_courses, total_chunks = rag.add_course_folder("/nonexistent/folder")
+        total_courses, total_chunks = rag_system.add_course_folder(
+            "/nonexistent/folder"
+        )
 
         assert total_courses == 0
         assert total_chunks == 0
 
-    def test_add_course_folder_clear_existing(self, test_config, temp_dir):
+    def test_add_course_folder_clear_existing(self, rag_system):
         """Test clearing existing data before adding new courses"""
-        # Create test document
-        test_file = os.path.join(temp_dir, "course1.txt")
-        with open(test_file, "w") as f:
-            f.write(
-                """Course Title: Test Course
-Course Link: http://example.com
-Course Instructor: Test Instructor
-
-Lesson 1: Introduction
-This is the content."""
-            )
-
-        rag = RAGSystem(test_config)
-
-        # Add first time
-        rag.add_course_folder(temp_dir)
-        initial_count = rag.vector_store.get_course_count()
-
-        # Add again with clear_existing=True
-        total_courses, total_chunks = rag.add_course_folder(
-            temp_dir, clear_existing=True
+        rag_system.add_course_text(ANALYTICS_COURSE_TEXT, "test_course.txt")
+        initial_count = rag_system.vector_store.get_course_count()
+        assert initial_count == 1
+
+        # Clearing happens before the folder is read, so a missing folder
+        # adds nothing and only the clear is observable
+        total_courses, total_chunks = rag_system.add_course_folder(
+            "/nonexistent/folder", clear_existing=True
         )
-        final_count = rag.vector_store.get_course_count()
 
-        assert total_courses == 1
-        assert (
-            final_count == initial_count
-        )  # Should be same after clearing and re-adding
+        assert (total_courses, total_chunks) == (0, 0)
+        assert rag_system.vector_store.get_course_count() == 0
+
+        # The recreated collections accept new data
+        rag_system.add_course_text(ANALYTICS_COURSE_TEXT, "test_course.txt")
+        assert rag_system.vector_store.get_course_count() == initial_count
 
 
 class TestRAGSystemQuerying:
     """Test query processing functionality"""
 
-    @patch("ai_generator.AIGenerator.generate_response")
-    def test_query_without_session(self, mock_generate, test_config):
+    async def test_query_without_session(self, rag_system, fake_anthropic):
         """Test query processing without session ID"""
-        mock_generate.return_value = "Test AI response"
+        fake_anthropic.messages.create.return_value = end_resp("Test AI response")
 
-        rag = RAGSystem(test_config)
-        response, sources = rag.query("What is machine learning?")
+        response, sources = await rag_system.query("What is machine learning?")
 
         assert response == "Test AI response"
         assert isinstance(sources, list)
 
-        # Verify AI generator was called correctly
-        mock_generate.assert_called_once()
-        call_args = mock_generate.call_args
+        # Verify the API request carried the query and tools but no history
+        fake_anthropic.messages.create.assert_called_once()
+        params = fake_anthropic.messages.create.call_args.kwargs
 
-        assert "What is machine learning?" in call_args[1]["query"]
-        assert call_args[1]["conversation_history"] is None
-        assert call_args[1]["tools"] is not None
-        assert call_args[1]["tool_manager"] is not None
+        assert "What is machine learning?" in params["messages"][0]["content"]
+        assert len(params["system"]) == 1
+        assert params["tools"]
 
-    @patch("ai_generator.AIGenerator.generate_response")
-    def test_query_with_session(self, mock_generate, test_config):
+    async def test_query_with_session(self, rag_system, fake_anthropic):
         """Test query processing with session ID"""
-        mock_generate.return_value = "Test AI response with context"
-
-        rag = RAGSystem(test_config)
+        fake_anthropic.messages.create.return_value = end_resp(
+            "Test AI response with context"
+        )
 
         # Create a session and add some history
-        session_id = rag.session_manager.create_session()
-        rag.session_manager.add_exchange(
+        session_id = rag_system.session_manager.create_session()
+        rag_system.session_manager.add_exchange(
             session_id, "Previous question", "Previous answer"
         )
 
-        response, sources = rag.query("Follow-up question", session_id=session_id)
+        response, sources = await rag_system.query(
+            "Follow-up question", session_id=session_id
+        )
 
         assert response == "Test AI response with context"
 
         # Verify conversation history was passed
-        call_args = mock_generate.call_args
-        assert call_args[1]["conversation_history"] is not None
+        params = fake_anthropic.messages.create.call_args.kwargs
+        assert "Previous question" in params["system"][-1]["text"]
 
-    @patch("ai_generator.AIGenerator.generate_response")
-    def test_query_updates_session_history(self, mock_generate, test_config):
+    async def test_query_updates_session_history(self, rag_system):
         """Test that queries update session history"""
-        mock_generate.return_value = "AI response"
-
-        rag = RAGSystem(test_config)
-        session_id = rag.session_manager.create_session()
+        session_id = rag_system.session_manager.create_session()
 
         # Initial query
-        rag.query("First question", session_id=session_id)
+        await rag_system.query("First question", session_id=session_id)
 
         # Check history was updated
-        history = rag.session_manager.get_conversation_history(session_id)
+        history = rag_system.session_manager.get_conversation_history(session_id)
         assert "First question" in history
-        assert "AI response" in history
-
-    @patch("ai_generator.AIGenerator.generate_response")
-    def test_query_tool_sources_tracking(self, mock_generate, test_config):
-        """Test that sources from tools are properly tracked"""
-        mock_generate.return_value = "AI response using tools"
-
-        rag = RAGSystem(test_config)
-
-        # Mock the tool manager to return sources
-        rag.tool_manager.get_last_sources = Mock(return_value=["Source 1", "Source 2"])
-        rag.tool_manager.reset_sources = Mock()
-
-        response, sources = rag.query("Search for Python basics")
-
-        assert sources == ["Source 1", "Source 2"]
-        rag.tool_manager.get_last_sources.assert_called_once()
-        rag.tool_manager.reset_sources.assert_called_once()
+        assert FAKE_ANSWER in history
+
+    async def test_query_tool_sources_tracking(self, rag_system, fake_anthropic):
+        """Test that sources from this query's tool calls are returned"""
+        rag_system.add_course_text(PROGRAMMING_COURSE_TEXT, "programming_course.txt")
+        seed_responses(
+            fake_anthropic,
+            tool_use_resp(
+                "search_course_content",
+                "tool_1",
+                {"query": "Python", "course_name": "Programming Fundamentals"},
+            ),
+            end_resp("Python is covered in lesson 1"),
+        )
 
-    def test_query_integration_with_real_tools(self, test_config, temp_dir):
-        """Test query integration with real search tools"""
-        # Create a test document
-        test_file = os.path.join(temp_dir, "programming_course.txt")
-        with open(test_file, "w") as f:
-            f.write(
-                """Course Title: Programming Fundamentals
-Course Link: http://example.com/programming
-Course Instructor: Jane Doe
+        response, sources = await rag_system.query("Search for Python basics")
 
-Lesson 1: Python Basics
-Lesson Link: http://example.com/programming/lesson1
-Python is a high-level programming language. It is widely used for web development, data analysis, and machine learning.
+        assert response == "Python is covered in lesson 1"
+        assert sources
+        assert all(
+            source["text"].startswith("Programming Fundamentals") for source in sources
+        )
 
-Lesson 2: Data Structures
-Lesson Link: http://example.com/programming/lesson2
-Data structures are ways of organizing data. Common types include lists, dictionaries, and sets."""
+    async def test_concurrent_queries_keep_their_own_sources(
+        self, rag_system, fake_anthropic
+    ):
+        """Test that overlapping queries never receive each other's sources"""
+        rag_system.add_course_text(PROGRAMMING_COURSE_TEXT, "programming_course.txt")
+        rag_system.add_course_text(ANALYTICS_COURSE_TEXT, "analytics_course.txt")
+        courses = {
+            "Python": "Programming Fundamentals",
+            "Analytics": "Analytics Test Course",
+        }
+
+        def respond(messages, **_):
+            # First turn searches the course named in the question
+            if len(messages) > 1:
+                return end_resp("Answer")
+            topic = next(t for t in courses if t in messages[0]["content"])
+            return tool_use_resp(
+                "search_course_content",
+                f"tool_{topic}",
+                {"query": "lesson", "course_name": courses[topic]},
             )
 
-        rag = RAGSystem(test_config)
-        rag.add_course_document(test_file)
+        fake_anthropic.messages.create.side_effect = respond
 
-        # Mock AI generator to simulate tool use
-        with patch.object(rag.ai_generator, "generate_response") as mock_generate:
-            # Simulate AI deciding to use search tool
-            def mock_ai_response(
-                query, conversation_history=None, tools=None, tool_manager=None
-            ):
-                if tool_manager:
-                    # Simulate tool execution
-                    search_result = tool_manager.execute_tool(
-                        "search_course_content", query="Python basics"
-                    )
-                    return f"Based on the course materials: {search_result[:100]}..."
-                return "No tools available"
+        results = await asyncio.gather(
+            rag_system.query("Python lessons"),
+            rag_system.query("Analytics lessons"),
+        )
+
+        # Lessons without a link are reported as plain strings
+        for (_, sources), course in zip(results, courses.values()):
+            texts = [s["text"] if isinstance(s, dict) else s for s in sources]
+            assert texts
+            assert all(text.startswith(course) for text in texts)
+
+    @pytest.mark.slow
+    @pytest.mark.usefixtures("real_embeddings")
+    @pytest.mark.integration
+    async def test_query_integration_with_real_tools(
+        self, fresh_rag_system, fake_anthropic
+    ):
+        """Test query integration with real search tools and embeddings"""
+        # Own instance: the shared one is built with fake embeddings
+        rag = fresh_rag_system
+        rag.add_course_text(PROGRAMMING_COURSE_TEXT, "programming_course.txt")
+
+        # Claude asks for one search, then answers
+        seed_responses(
+            fake_anthropic,
+            tool_use_resp(
+                "search_course_content", "tool_1", {"query": "Python basics"}
+            ),
+            end_resp("Python is covered in lesson 1"),
+        )
 
-            mock_generate.side_effect = mock_ai_response
+        response, sources = await rag.query("Tell me about Python")
 
-            response, sources = rag.query("Tell me about Python")
+        assert response == "Python is covered in lesson 1"
+        assert len(sources) > 0  # Should have sources from search
 
-            assert "Python is a high-level programming language" in response
-            assert len(sources) > 0  # Should have sources from search
+        # The real search result was fed back to Claude
+        messages = fake_anthropic.messages.create.call_args.kwargs["messages"]
+        tool_result = messages[-1]["content"][0]
+        assert tool_result["tool_use_id"] == "tool_1"
+        assert "Python is a high-level programming language" in tool_result["content"]
 
 
 class TestRAGSystemAnalytics:
     """Test analytics and reporting functionality"""
 
-    def test_get_course_analytics_empty(self, test_config):
+    def test_get_course_analytics_empty(self, rag_system):
         """Test analytics with no courses"""
-        rag = RAGSystem(test_config)
-        analytics = rag.get_course_analytics()
+        analytics = rag_system.get_course_analytics()
 
         assert analytics["total_courses"] == 0
         assert analytics["course_titles"] == []
 
-    def test_get_course_analytics_with_courses(self, test_config, temp_dir):
+    def test_get_course_analytics_with_courses(self, rag_system):
         """Test analytics with courses loaded"""
-        # Create test documents
-        test_file = os.path.join(temp_dir, "test_course.txt")
-        with open(test_file, "w") as f:
-            f.write(
-                """Course Title: Analytics Test Course
-Course Link: http://example.com
-Course Instructor: Test Instructor
-
-Lesson 1: Introduction
-Content here."""
-            )
-
-        rag = RAGSystem(test_config)
-        rag.add_course_document(test_file)
+        rag_system.add_course_text(ANALYTICS_COURSE_TEXT, "test_course.txt")
 
-        analytics = rag.get_course_analytics()
+        analytics = rag_system.get_course_analytics()
 
         assert analytics["total_courses"] == 1
         assert "Analytics Test Course" in analytics["course_titles"]
@@ -306,37 +396,30 @@ Content here."""
 class TestRAGSystemErrorHandling:
     """Test error handling in various scenarios"""
 
-    @patch("ai_generator.AIGenerator.generate_response")
-    def test_query_ai_generator_exception(self, mock_generate, test_config):
+    async def test_query_ai_generator_exception(self, rag_system, fake_anthropic):
         """Test handling of AI generator exceptions"""
-        mock_generate.side_effect = Exception("API Error")
-
-        rag = RAGSystem(test_config)
+        fake_anthropic.messages.create.side_effect = Exception("API Error")
 
         # This should not crash the system
         with pytest.raises(Exception):
-            rag.query("Test question")
+            await rag_system.query("Test question")
 
-    def test_query_with_invalid_session_id(self, test_config):
+    async def test_query_with_invalid_session_id(self, rag_system):
         """Test query with non-existent session ID"""
-        rag = RAGSystem(test_config)
-
         # Should handle gracefully - create new session or return empty history
-        response, sources = rag.query("Test question", session_id="invalid-session-id")
+        response, sources = await rag_system.query(
+            "Test question", session_id="invalid-session-id"
+        )
 
         # Should not crash
         assert isinstance(response, str)
         assert isinstance(sources, list)
 
-    def test_document_processing_error_handling(self, test_config, temp_dir):
+    def test_document_processing_error_handling(self, rag_system):
         """Test error handling during document processing"""
-        # Create invalid document
-        test_file = os.path.join(temp_dir, "invalid.txt")
-        with open(test_file, "w") as f:
-            f.write("Invalid document format without proper headers")
-
-        rag = RAGSystem(test_config)
-        course, chunk_count = rag.add_course_document(test_file)
+        course, chunk_count = rag_system.add_course_text(
+            "Invalid document format without proper headers", "invalid.txt"
+        )
 
         # Should handle gracefully
         assert course is None
@@ -346,50 +429,40 @@ class TestRAGSystemErrorHandling:
 class TestRAGSystemPerformance:
     """Test performance-related aspects"""
 
-    def test_session_memory_management(self, test_config):
+    def test_session_memory_management(self, rag_system, shared_config):
         """Test that session history is properly limited"""
-        rag = RAGSystem(test_config)
-        session_id = rag.session_manager.create_session()
+        session_id = rag_system.session_manager.create_session()
 
         # Add more exchanges than MAX_HISTORY allows
-        for i in range(test_config.MAX_HISTORY + 2):
-            rag.session_manager.add_exchange(session_id, f"Question {i}", f"Answer {i}")
+        for i in range(shared_config.MAX_HISTORY + 2):
+            rag_system.session_manager.add_exchange(
+                session_id, f"Question {i}", f"Answer {i}"
+            )
 
-        history = rag.session_manager.get_conversation_history(session_id)
+        history = rag_system.session_manager.get_conversation_history(session_id)
 
         # History should be limited
         # Each exchange creates 2 lines (Q and A), so MAX_HISTORY * 2 lines total
         line_count = len([line for line in history.split("\n") if line.strip()])
         assert (
-            line_count <= test_config.MAX_HISTORY * 2 + 2
+            line_count <= shared_config.MAX_HISTORY * 2 + 2
         )  # Allow some flexibility for formatting
 
-    def test_vector_store_limits(self, test_config, temp_dir):
+    def test_vector_store_limits(self, rag_system, shared_config):
         """Test that vector store respects MAX_RESULTS limit"""
-        # Create course with multiple lessons to generate multiple chunks
-        test_file = os.path.join(temp_dir, "large_course.txt")
-        with open(test_file, "w") as f:
-            f.write(
-                """Course Title: Large Course
-Course Link: http://example.com
-Course Instructor: Test Instructor
-
-"""
+        # More matching chunks than MAX_RESULTS, inserted without chunking
+        chunks = [
+            CourseChunk(
+                content=f"Python programming chunk {i}",
+                course_title="Large Course",
+                lesson_number=i + 1,
+                chunk_index=i,
             )
-            # Add multiple lessons with similar content to get multiple matches
-            for i in range(10):
-                f.write(
-                    f"""Lesson {i+1}: Python Programming {i+1}
-Lesson Link: http://example.com/lesson{i+1}
-Python is a programming language used for development. This lesson covers Python fundamentals and basic concepts.
-
-"""
-                )
-
-        rag = RAGSystem(test_config)
-        rag.add_course_document(test_file)
+            for i in range(10)
+        ]
+        rag_system.vector_store.add_course_content(chunks)
 
         # Search should respect MAX_RESULTS limit
-        results = rag.vector_store.search("Python programming")
+        results = rag_system.vector_store.search("Python programming")
 
-        assert len(results.documents) <= test_config.MAX_RESULTS
+        assert len(results.documents) == shared_config.MAX_RESULTS
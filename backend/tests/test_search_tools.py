@@ -1,11 +1,6 @@
-import os
-import sys
 from unittest.mock import MagicMock, Mock
 
 import pytest
-
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
 from search_tools import CourseOutlineTool, CourseSearchTool, ToolManager
 from vector_store import SearchResults
 
@@ -25,91 +20,56 @@ class TestCourseSearchTool:
         assert "course_name" in definition["input_schema"]["properties"]
         assert "lesson_number" in definition["input_schema"]["properties"]
 
-    def test_execute_basic_query(
-        self, course_search_tool, mock_vector_store, sample_chunks
+    @pytest.mark.parametrize(
+        "course_name,lesson_number,expected_header",
+        [
+            (None, None, "[Test Course - Lesson 1]"),
+            ("Test Course", None, "[Test Course - Lesson 1]"),
+            (None, 2, "[Test Course - Lesson 2]"),
+            ("Test Course", 1, "[Test Course - Lesson 1]"),
+        ],
+        ids=["no_filter", "course", "lesson", "both"],
+    )
+    def test_execute_with_filters(
+        self,
+        course_search_tool,
+        mock_vector_store,
+        course_name,
+        lesson_number,
+        expected_header,
     ):
-        """Test basic query execution without filters"""
-        # Setup mock to return sample data
-        mock_vector_store.search.return_value = SearchResults(
-            documents=[chunk.content for chunk in sample_chunks],
+        """Test query execution passes filters through and labels results"""
+        mock_vector_store.search_results = SearchResults(
+            documents=["Test content"],
             metadata=[
-                {
-                    "course_title": chunk.course_title,
-                    "lesson_number": chunk.lesson_number,
-                    "chunk_index": chunk.chunk_index,
-                }
-                for chunk in sample_chunks
+                {"course_title": "Test Course", "lesson_number": lesson_number or 1}
             ],
-            distances=[0.1, 0.2, 0.3],
-        )
-
-        result = course_search_tool.execute("test query")
-
-        # Verify search was called with correct parameters
-        mock_vector_store.search.assert_called_once_with(
-            query="test query", course_name=None, lesson_number=None
-        )
-
-        # Verify result format
-        assert isinstance(result, str)
-        assert "Test Course" in result
-        assert "introduction" in result.lower()
-        assert "[Test Course - Lesson 1]" in result
-
-    def test_execute_with_course_filter(self, course_search_tool, mock_vector_store):
-        """Test query execution with course name filter"""
-        mock_vector_store.search.return_value = SearchResults(
-            documents=["Test content"],
-            metadata=[{"course_title": "Test Course", "lesson_number": 1}],
-            distances=[0.1],
-        )
-
-        result = course_search_tool.execute("test query", course_name="Test Course")
-
-        mock_vector_store.search.assert_called_once_with(
-            query="test query", course_name="Test Course", lesson_number=None
-        )
-
-        assert "Test Course" in result
-
-    def test_execute_with_lesson_filter(self, course_search_tool, mock_vector_store):
-        """Test query execution with lesson number filter"""
-        mock_vector_store.search.return_value = SearchResults(
-            documents=["Test content"],
-            metadata=[{"course_title": "Test Course", "lesson_number": 2}],
-            distances=[0.1],
-        )
-
-        result = course_search_tool.execute("test query", lesson_number=2)
-
-        mock_vector_store.search.assert_called_once_with(
-            query="test query", course_name=None, lesson_number=2
-        )
-
-        assert "Lesson 2" in result
-
-    def test_execute_with_both_filters(self, course_search_tool, mock_vector_store):
-        """Test query execution with both course and lesson filters"""
-        mock_vector_store.search.return_value = SearchResults(
-            documents=["Test content"],
-            metadata=[{"course_title": "Test Course", "lesson_number": 1}],
             distances=[0.1],
         )
 
         result = course_search_tool.execute(
-            "test query", course_name="Test Course", lesson_number=1
+            "test query", course_name=course_name, lesson_number=lesson_number
         )
 
-        mock_vector_store.search.assert_called_once_with(
-            query="test query", course_name="Test Course", lesson_number=1
+        # Verify search was called with correct parameters
+        assert mock_vector_store.calls[0] == (
+            "search",
+            {
+                "query": "test query",
+                "course_name": course_name,
+                "lesson_number": lesson_number,
+                "limit": None,
+            },
         )
 
-        assert "Test Course" in result
-        assert "Lesson 1" in result
+        # Verify result format
+        assert isinstance(result, str)
+        assert expected_header in result
+        assert "Test content" in result
 
     def test_execute_empty_results(self, course_search_tool, mock_vector_store):
         """Test handling of empty search results"""
-        mock_vector_store.search.return_value = SearchResults(
+        mock_vector_store.search_results = SearchResults(
             documents=[], metadata=[], distances=[]
         )
 
@@ -121,7 +81,7 @@ class TestCourseSearchTool:
         self, course_search_tool, mock_vector_store
     ):
         """Test handling of empty results with filters applied"""
-        mock_vector_store.search.return_value = SearchResults(
+        mock_vector_store.search_results = SearchResults(
             documents=[], metadata=[], distances=[]
         )
 
@@ -133,7 +93,7 @@ class TestCourseSearchTool:
 
     def test_execute_error_handling(self, course_search_tool, mock_vector_store):
         """Test handling of search errors"""
-        mock_vector_store.search.return_value = SearchResults.empty(
+        mock_vector_store.search_results = SearchResults.empty(
             "Database connection failed"
         )
 
@@ -152,7 +112,7 @@ class TestCourseSearchTool:
             distances=[0.1, 0.2],
         )
 
-        formatted = course_search_tool._format_results(results)
+        formatted, sources = course_search_tool._format_results(results)
 
         assert "[Test Course - Lesson 1]" in formatted
         assert "[Test Course - Lesson 2]" in formatted
@@ -161,7 +121,7 @@ class TestCourseSearchTool:
 
     def test_format_results_with_links(self, course_search_tool, mock_vector_store):
         """Test result formatting with lesson links"""
-        mock_vector_store.get_lesson_link.return_value = "http://example.com/lesson1"
+        mock_vector_store.lesson_link = "http://example.com/lesson1"
 
         results = SearchResults(
             documents=["Test content"],
@@ -169,14 +129,19 @@ class TestCourseSearchTool:
             distances=[0.1],
         )
 
-        formatted = course_search_tool._format_results(results)
+        formatted, sources = course_search_tool._format_results(results)
 
         # Verify lesson link was requested
-        mock_vector_store.get_lesson_link.assert_called_once_with("Test Course", 1)
-
-        # Verify sources are tracked
-        assert len(course_search_tool.last_sources) == 1
-        source = course_search_tool.last_sources[0]
+        assert mock_vector_store.calls == [
+            (
+                "get_lesson_link",
+                {"course_title": "Test Course", "lesson_number": 1},
+            )
+        ]
+
+        # Verify sources are returned with the text
+        assert len(sources) == 1
+        source = sources[0]
         assert isinstance(source, dict)
         assert source["text"] == "Test Course - Lesson 1"
         assert source["link"] == "http://example.com/lesson1"
@@ -189,14 +154,13 @@ class TestCourseSearchTool:
             distances=[0.1],
         )
 
-        formatted = course_search_tool._format_results(results)
+        formatted, sources = course_search_tool._format_results(results)
 
         assert "[Test Course]" in formatted
         assert "Course overview content" in formatted
 
-        # Should store plain text source
-        assert len(course_search_tool.last_sources) == 1
-        assert course_search_tool.last_sources[0] == "Test Course"
+        # Should return a plain text source
+        assert sources == ["Test Course"]
 
 
 class TestCourseOutlineTool:
@@ -217,8 +181,8 @@ class TestCourseOutlineTool:
     def test_execute_existing_course(self, mock_vector_store):
         """Test outline retrieval for existing course"""
         # Setup mock responses
-        mock_vector_store._resolve_course_name.return_value = "Test Course"
-        mock_vector_store.course_catalog.get.return_value = {
+        mock_vector_store.resolved_course = "Test Course"
+        mock_vector_store.course_catalog.result = {
             "metadatas": [
                 {
                     "title": "Test Course",
@@ -238,9 +202,21 @@ class TestCourseOutlineTool:
         assert "1. Introduction" in result
         assert "2. Advanced Topics" in result
 
+    def test_execute_malformed_lessons_json(self, mock_vector_store):
+        """Test that unparseable lessons JSON yields an outline without lessons"""
+        mock_vector_store.course_catalog.result = {
+            "metadatas": [{"title": "Test Course", "lessons_json": "[{not json"}]
+        }
+
+        tool = CourseOutlineTool(mock_vector_store)
+        result = tool.execute("Test Course")
+
+        assert "**Course:** Test Course" in result
+        assert "No lessons found" in result
+
     def test_execute_nonexistent_course(self, mock_vector_store):
         """Test outline retrieval for non-existent course"""
-        mock_vector_store._resolve_course_name.return_value = None
+        mock_vector_store.resolved_course = None
 
         tool = CourseOutlineTool(mock_vector_store)
         result = tool.execute("Nonexistent Course")
@@ -249,8 +225,8 @@ class TestCourseOutlineTool:
 
     def test_execute_missing_metadata(self, mock_vector_store):
         """Test handling of missing course metadata"""
-        mock_vector_store._resolve_course_name.return_value = "Test Course"
-        mock_vector_store.course_catalog.get.return_value = {"metadatas": []}
+        mock_vector_store.resolved_course = "Test Course"
+        mock_vector_store.course_catalog.result = {"metadatas": []}
 
         tool = CourseOutlineTool(mock_vector_store)
         result = tool.execute("Test Course")
@@ -259,8 +235,8 @@ class TestCourseOutlineTool:
 
     def test_execute_exception_handling(self, mock_vector_store):
         """Test exception handling in outline tool"""
-        mock_vector_store._resolve_course_name.return_value = "Test Course"
-        mock_vector_store.course_catalog.get.side_effect = Exception("Database error")
+        mock_vector_store.resolved_course = "Test Course"
+        mock_vector_store.course_catalog.error = Exception("Database error")
 
         tool = CourseOutlineTool(mock_vector_store)
         result = tool.execute("Test Course")
@@ -295,9 +271,30 @@ class TestToolManager:
         assert len(definitions) == 1
         assert definitions[0]["name"] == "search_course_content"
 
+    def test_get_tool_definitions_memoized(self):
+        """Test definitions are built once and rebuilt after a registration"""
+        manager = ToolManager()
+        first_tool = Mock()
+        first_tool.get_tool_definition.return_value = {"name": "first"}
+        manager.register_tool(first_tool)
+
+        definitions = manager.get_tool_definitions()
+        assert manager.get_tool_definitions() is definitions
+        # One call while registering, one while building the list
+        assert first_tool.get_tool_definition.call_count == 2
+
+        second_tool = Mock()
+        second_tool.get_tool_definition.return_value = {"name": "second"}
+        manager.register_tool(second_tool)
+
+        assert [d["name"] for d in manager.get_tool_definitions()] == [
+            "first",
+            "second",
+        ]
+
     def test_execute_tool(self, tool_manager, mock_vector_store):
         """Test tool execution"""
-        mock_vector_store.search.return_value = SearchResults(
+        mock_vector_store.search_results = SearchResults(
             documents=["test content"],
             metadata=[{"course_title": "Test", "lesson_number": 1}],
             distances=[0.1],
@@ -308,30 +305,31 @@ class TestToolManager:
         assert isinstance(result, str)
         assert "test content" in result
 
+    def test_execute_tool_with_sources(self, tool_manager, mock_vector_store):
+        """Test that each call returns its own sources alongside the result"""
+        mock_vector_store.search_results = SearchResults(
+            documents=["test content"],
+            metadata=[{"course_title": "Test", "lesson_number": 1}],
+            distances=[0.1],
+        )
+
+        result, sources = tool_manager.execute_tool_with_sources(
+            "search_course_content", query="test"
+        )
+
+        assert "test content" in result
+        assert sources == [
+            {"text": "Test - Lesson 1", "link": "http://example.com/lesson1"}
+        ]
+
+        # Errors and unknown tools carry no sources
+        assert tool_manager.execute_tool_with_sources("nonexistent_tool") == (
+            "Tool 'nonexistent_tool' not found",
+            [],
+        )
+
     def test_execute_nonexistent_tool(self, tool_manager):
         """Test executing non-existent tool"""
         result = tool_manager.execute_tool("nonexistent_tool", query="test")
 
         assert "Tool 'nonexistent_tool' not found" in result
-
-    def test_get_last_sources(self, tool_manager, course_search_tool):
-        """Test getting last sources from tools"""
-        # Set up sources on the search tool
-        course_search_tool.last_sources = ["source1", "source2"]
-
-        sources = tool_manager.get_last_sources()
-        assert sources == ["source1", "source2"]
-
-    def test_get_last_sources_empty(self, tool_manager):
-        """Test getting last sources when no sources exist"""
-        sources = tool_manager.get_last_sources()
-        assert sources == []
-
-    def test_reset_sources(self, tool_manager, course_search_tool):
-        """Test resetting sources from all tools"""
-        # Set up sources on the search tool
-        course_search_tool.last_sources = ["source1", "source2"]
-
-        tool_manager.reset_sources()
-
-        assert course_search_tool.last_sources == []
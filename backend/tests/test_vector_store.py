@@ -1,51 +1,44 @@
-import os
-import sys
 from unittest.mock import Mock, patch
 
+import numpy as np
 import pytest
+from chromadb.utils.embedding_functions import SentenceTransformerEmbeddingFunction
+from vector_store import (
+    SearchResults,
+    VectorStore,
+    _CachedEmbeddingFunction,
+    _get_embedding_function,
+)
 
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from models import Course, CourseChunk, Lesson
-from vector_store import SearchResults, VectorStore
+class RaisingCollection:
+    """Empty collection whose queries fail like a broken database"""
+
+    def get(self, *args, **kwargs):
+        return {"ids": [], "documents": [], "metadatas": [], "embeddings": []}
+
+    def query(self, *args, **kwargs):
+        raise Exception("Database error")
+
+
+class StubClient:
+    """Chroma client handing out RaisingCollections"""
+
+    def get_or_create_collection(self, *args, **kwargs):
+        return RaisingCollection()
 
 
 class TestVectorStore:
     """Test suite for VectorStore functionality"""
 
-    def test_max_results_zero_bug(self, temp_dir):
+    def test_max_results_zero_bug(
+        self, vector_store_factory, sample_course, sample_chunks
+    ):
         """Test that MAX_RESULTS=0 causes no results to be returned"""
-        # Create vector store with MAX_RESULTS=0 to reproduce the bug
-        store = VectorStore(
-            chroma_path=os.path.join(temp_dir, "test_chroma"),
-            embedding_model="all-MiniLM-L6-v2",
-            max_results=0,  # This should cause the bug
-        )
+        store = vector_store_factory(0)  # This should cause the bug
 
-        # Add some test data
-        course = Course(
-            title="Test Course",
-            instructor="Test Instructor",
-            course_link="http://example.com",
-            lessons=[
-                Lesson(
-                    lesson_number=1,
-                    title="Test Lesson",
-                    lesson_link="http://example.com/1",
-                )
-            ],
-        )
-        chunks = [
-            CourseChunk(
-                course_title="Test Course",
-                lesson_number=1,
-                chunk_index=0,
-                content="This is test content that should be searchable",
-            )
-        ]
-
-        store.add_course_metadata(course)
-        store.add_course_content(chunks)
+        store.add_course_metadata(sample_course)
+        store.add_course_content(sample_chunks)
 
         # Search should return no results due to MAX_RESULTS=0
         results = store.search("test content")
@@ -56,39 +49,15 @@ class TestVectorStore:
             results.is_empty()
         ), "MAX_RESULTS=0 should return no results (reproducing bug)"
 
-    def test_max_results_fixed(self, temp_dir):
+    @pytest.mark.benchmark
+    def test_max_results_fixed(
+        self, vector_store_factory, sample_course, sample_chunks
+    ):
         """Test that MAX_RESULTS=5 returns proper results"""
-        # Create vector store with MAX_RESULTS=5 (fixed value)
-        store = VectorStore(
-            chroma_path=os.path.join(temp_dir, "test_chroma_fixed"),
-            embedding_model="all-MiniLM-L6-v2",
-            max_results=5,  # Fixed value
-        )
+        store = vector_store_factory(5)  # Fixed value
 
-        # Add some test data
-        course = Course(
-            title="Test Course",
-            instructor="Test Instructor",
-            course_link="http://example.com",
-            lessons=[
-                Lesson(
-                    lesson_number=1,
-                    title="Test Lesson",
-                    lesson_link="http://example.com/1",
-                )
-            ],
-        )
-        chunks = [
-            CourseChunk(
-                course_title="Test Course",
-                lesson_number=1,
-                chunk_index=0,
-                content="This is test content that should be searchable",
-            )
-        ]
-
-        store.add_course_metadata(course)
-        store.add_course_content(chunks)
+        store.add_course_metadata(sample_course)
+        store.add_course_content(sample_chunks)
 
         # Search should return results with MAX_RESULTS=5
         results = store.search("test content")
@@ -98,6 +67,15 @@ class TestVectorStore:
         assert len(results.documents) > 0, "Should have at least one document"
         assert results.error is None, "Should not have errors"
 
+    def test_search_latency_benchmark(self, benchmark, real_vector_store, monkeypatch):
+        """Benchmark an unfiltered search; run with --codspeed to measure"""
+        # Time the retrieval path rather than result cache hits
+        monkeypatch.setattr(real_vector_store, "QUERY_CACHE_TTL", 0.0)
+
+        results = benchmark(real_vector_store.search, "introduction")
+
+        assert not results.is_empty(), "Search should return results"
+
     def test_search_with_course_filter(self, real_vector_store):
         """Test search with course name filtering"""
         results = real_vector_store.search("introduction", course_name="Test Course")
@@ -106,8 +84,7 @@ class TestVectorStore:
         assert results.error is None, "Should not have errors"
 
         # Check that all results are from the specified course
-        for metadata in results.metadata:
-            assert metadata["course_title"] == "Test Course"
+        assert {m["course_title"] for m in results.metadata} == {"Test Course"}
 
     def test_search_with_lesson_filter(self, real_vector_store):
         """Test search with lesson number filtering"""
@@ -117,8 +94,7 @@ class TestVectorStore:
         assert results.error is None, "Should not have errors"
 
         # Check that all results are from the specified lesson
-        for metadata in results.metadata:
-            assert metadata["lesson_number"] == 1
+        assert {m["lesson_number"] for m in results.metadata} == {1}
 
     def test_search_with_both_filters(self, real_vector_store):
         """Test search with both course and lesson filters"""
@@ -130,10 +106,12 @@ class TestVectorStore:
         assert results.error is None, "Should not have errors"
 
         # Check that all results match both filters
-        for metadata in results.metadata:
-            assert metadata["course_title"] == "Test Course"
-            assert metadata["lesson_number"] == 1
+        assert {m["course_title"] for m in results.metadata} == {"Test Course"}
+        assert {m["lesson_number"] for m in results.metadata} == {1}
 
+    @pytest.mark.slow
+    @pytest.mark.usefixtures("real_embeddings")
+    @pytest.mark.integration
     def test_search_nonexistent_course(self, real_vector_store):
         """Test search with non-existent course name"""
         results = real_vector_store.search(
@@ -143,6 +121,145 @@ class TestVectorStore:
         assert results.error is not None, "Should return error for nonexistent course"
         assert "No course found" in results.error
 
+    def test_filtered_search_ranks_small_candidate_sets_locally(
+        self, vector_store_factory, sample_course, sample_chunks, monkeypatch
+    ):
+        """Test that a small filtered search skips Chroma yet ranks the same"""
+        store = vector_store_factory()
+        store.add_course_metadata(sample_course)
+        store.add_course_content(sample_chunks)
+        expected = store.course_content.query(
+            query_texts=["introduction concepts"],
+            n_results=store.max_results,
+            where=store._build_filter("Test Course", 1),
+        )
+
+        query = Mock(side_effect=AssertionError("content should not be queried"))
+        monkeypatch.setattr(store.course_content, "query", query)
+        results = store.search(
+            "introduction concepts", course_name="Test Course", lesson_number=1
+        )
+
+        assert results.documents == expected["documents"][0]
+        assert results.metadata == expected["metadatas"][0]
+        assert results.distances == pytest.approx(expected["distances"][0], rel=1e-4)
+
+    def test_filtered_search_uses_chroma_for_large_candidate_sets(
+        self, vector_store_factory, sample_course, sample_chunks, monkeypatch
+    ):
+        """Test that candidate sets past the local limit go through Chroma"""
+        store = vector_store_factory(1)
+        store.add_course_metadata(sample_course)
+        store.add_course_content(sample_chunks)
+        monkeypatch.setattr(store, "LOCAL_RANK_FACTOR", 1)
+        query = Mock(wraps=store.course_content.query)
+        monkeypatch.setattr(store.course_content, "query", query)
+
+        results = store.search("introduction", course_name="Test Course")
+
+        query.assert_called_once()
+        assert len(results.documents) == 1
+
+    def test_chunk_index_loads_on_first_filtered_search(
+        self, vector_store_factory, sample_course, sample_chunks, monkeypatch
+    ):
+        """Test that an opened store copies its chunks only when first needed"""
+        store = vector_store_factory()
+        store.add_course_metadata(sample_course)
+        store.add_course_content(sample_chunks)
+
+        reopened = VectorStore(
+            VectorStore.MEMORY_PATH,
+            "unused-model",
+            client=store.client,
+            embedding_function=store.embedding_function,
+        )
+        assert not reopened._chunks_loaded
+
+        # Unfiltered searches never need the local copy
+        reopened.search("introduction")
+        assert not reopened._chunks_loaded
+
+        query = Mock(side_effect=AssertionError("content should not be queried"))
+        monkeypatch.setattr(reopened.course_content, "query", query)
+        results = reopened.search("introduction", course_name="Test Course")
+
+        assert reopened._chunks_loaded
+        assert len(reopened._chunks) == len(sample_chunks)
+        assert not results.is_empty()
+
+    def test_chunk_index_falls_back_to_chroma_past_size_cap(
+        self, vector_store_factory, sample_course, sample_chunks, monkeypatch
+    ):
+        """Test that collections over the cap are never copied locally"""
+        store = vector_store_factory()
+        monkeypatch.setattr(store, "LOCAL_INDEX_MAX_CHUNKS", len(sample_chunks) - 1)
+        store.add_course_metadata(sample_course)
+        store.add_course_content(sample_chunks)
+
+        # Growing past the cap drops the local copy
+        assert store._chunks_disabled
+        assert store._chunks == []
+
+        query = Mock(wraps=store.course_content.query)
+        monkeypatch.setattr(store.course_content, "query", query)
+        results = store.search("introduction", course_name="Test Course")
+
+        query.assert_called_once()
+        assert not results.is_empty()
+
+        # Clearing the store empties it, so the local copy is usable again
+        store.clear_all_data()
+        assert store._chunks_loaded and not store._chunks_disabled
+
+    def test_add_course_content_embeds_in_one_batch(
+        self, vector_store_factory, sample_chunks, monkeypatch
+    ):
+        """Test that all chunks are embedded by a single call"""
+        store = vector_store_factory()
+        embed = Mock(wraps=store.embedding_function)
+        monkeypatch.setattr(store, "embedding_function", embed)
+
+        store.add_course_content(sample_chunks)
+
+        embed.assert_called_once_with([chunk.content for chunk in sample_chunks])
+        assert store.course_content.count() == len(sample_chunks)
+
+    def test_repeated_search_served_from_cache(
+        self, vector_store_factory, sample_course, sample_chunks, monkeypatch
+    ):
+        """Test that a repeated search reuses its results until data changes"""
+        store = vector_store_factory()
+        store.add_course_metadata(sample_course)
+        store.add_course_content(sample_chunks)
+        uncached = Mock(wraps=store._search_uncached)
+        monkeypatch.setattr(store, "_search_uncached", uncached)
+
+        first = store.search("introduction")
+        assert store.search("introduction") is first
+        assert uncached.call_count == 1
+
+        # A different limit is a different search
+        store.search("introduction", limit=1)
+        assert uncached.call_count == 2
+
+        # New content invalidates the cache
+        store.add_course_content(sample_chunks[:1])
+        store.search("introduction")
+        assert uncached.call_count == 3
+
+    def test_cached_search_expires(
+        self, vector_store_factory, sample_course, sample_chunks, monkeypatch
+    ):
+        """Test that cached results are not reused past their TTL"""
+        store = vector_store_factory()
+        store.add_course_metadata(sample_course)
+        store.add_course_content(sample_chunks)
+        monkeypatch.setattr(store, "QUERY_CACHE_TTL", 0.0)
+
+        first = store.search("introduction")
+        assert store.search("introduction") is not first
+
     def test_resolve_course_name(self, real_vector_store):
         """Test course name resolution"""
         # Should find exact match
@@ -153,26 +270,50 @@ class TestVectorStore:
         resolved = real_vector_store._resolve_course_name("Test")
         assert resolved == "Test Course"
 
-    def test_build_filter_no_params(self, real_vector_store):
-        """Test filter building with no parameters"""
-        filter_dict = real_vector_store._build_filter(None, None)
-        assert filter_dict is None
-
-    def test_build_filter_course_only(self, real_vector_store):
-        """Test filter building with course only"""
-        filter_dict = real_vector_store._build_filter("Test Course", None)
-        assert filter_dict == {"course_title": "Test Course"}
-
-    def test_build_filter_lesson_only(self, real_vector_store):
-        """Test filter building with lesson only"""
-        filter_dict = real_vector_store._build_filter(None, 1)
-        assert filter_dict == {"lesson_number": 1}
+    def test_resolve_course_name_exact_title_skips_query(
+        self, vector_store_factory, sample_course, monkeypatch
+    ):
+        """Test that exact titles resolve from the index without a vector query"""
+        store = vector_store_factory()
+        store.add_course_metadata(sample_course)
+        query = Mock(side_effect=AssertionError("catalog should not be queried"))
+        monkeypatch.setattr(store.course_catalog, "query", query)
+
+        assert store._resolve_course_name("  test course ") == "Test Course"
+
+    def test_title_index_seeded_from_existing_catalog(
+        self, vector_store_factory, chroma_client, fake_embedding_fn, sample_course
+    ):
+        """Test that a store opened on existing data indexes its titles"""
+        vector_store_factory().add_course_metadata(sample_course)
+
+        reopened = VectorStore(
+            VectorStore.MEMORY_PATH,
+            "all-MiniLM-L6-v2",
+            client=chroma_client,
+            embedding_function=fake_embedding_fn,
+        )
 
-    def test_build_filter_both(self, real_vector_store):
-        """Test filter building with both course and lesson"""
-        filter_dict = real_vector_store._build_filter("Test Course", 1)
-        expected = {"$and": [{"course_title": "Test Course"}, {"lesson_number": 1}]}
-        assert filter_dict == expected
+        assert reopened._title_index == {"test course": "Test Course"}
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize(
+        "course_title,lesson_number,expected",
+        [
+            (None, None, None),
+            ("Test Course", None, {"course_title": "Test Course"}),
+            (None, 1, {"lesson_number": 1}),
+            (
+                "Test Course",
+                1,
+                {"$and": [{"course_title": "Test Course"}, {"lesson_number": 1}]},
+            ),
+        ],
+        ids=["no_params", "course_only", "lesson_only", "both"],
+    )
+    def test_build_filter(self, course_title, lesson_number, expected):
+        """Test filter building for each combination of parameters"""
+        assert VectorStore._build_filter(course_title, lesson_number) == expected
 
     def test_add_course_metadata(self, real_vector_store, sample_course):
         """Test adding course metadata"""
@@ -200,27 +341,110 @@ class TestVectorStore:
         link = real_vector_store.get_lesson_link("Test Course", 999)
         assert link is None
 
-    @patch("chromadb.PersistentClient")
-    def test_search_exception_handling(self, mock_client_class, temp_dir):
+    def test_search_exception_handling(self, fake_embedding_fn):
         """Test that search exceptions are handled properly"""
-        # Mock client to raise exception
-        mock_client = Mock()
-        mock_collection = Mock()
-        mock_collection.query.side_effect = Exception("Database error")
-        mock_client.get_or_create_collection.return_value = mock_collection
-        mock_client_class.return_value = mock_client
-
         store = VectorStore(
-            chroma_path=os.path.join(temp_dir, "test_error"),
-            embedding_model="all-MiniLM-L6-v2",
-            max_results=5,
+            VectorStore.MEMORY_PATH,
+            "all-MiniLM-L6-v2",
+            client=StubClient(),
+            embedding_function=fake_embedding_fn,
         )
 
         results = store.search("test query")
         assert results.error is not None
         assert "Search error" in results.error
 
+    @patch("chromadb.PersistentClient")
+    def test_injected_client_skips_persistent_client(
+        self, mock_client_class, chroma_client
+    ):
+        """Test that a supplied Chroma client is used instead of opening one"""
+        store = VectorStore(
+            "/nonexistent/chroma", "all-MiniLM-L6-v2", client=chroma_client
+        )
+
+        mock_client_class.assert_not_called()
+        assert store.client is chroma_client
+
+    def test_supplied_embedding_function_skips_model(
+        self, monkeypatch, fake_embedding_fn
+    ):
+        """Test that a supplied embedding function replaces the model"""
+        loader = Mock()
+        monkeypatch.setattr("vector_store._get_embedding_function", loader)
+
+        store = VectorStore(
+            VectorStore.MEMORY_PATH,
+            "all-MiniLM-L6-v2",
+            embedding_function=fake_embedding_fn,
+        )
+
+        store.close()
+        loader.assert_not_called()
+        assert store.embedding_function is fake_embedding_fn
+
+    def test_memory_stores_are_isolated(self, sample_course, sample_chunks):
+        """Test that in-memory stores never see each other's data"""
+        first = VectorStore(VectorStore.MEMORY_PATH, "all-MiniLM-L6-v2")
+        second = VectorStore(VectorStore.MEMORY_PATH, "all-MiniLM-L6-v2")
+
+        first.add_course_metadata(sample_course)
+        first.add_course_content(sample_chunks)
+
+        assert first.get_course_count() == 1
+        assert second.get_course_count() == 0
+        assert second.course_content.count() == 0
+
+        first.close()
+        second.close()
+
+    def test_close_deletes_memory_database(self):
+        """Test that closing an in-memory store drops its private database"""
+        import chromadb
+
+        store = VectorStore(VectorStore.MEMORY_PATH, "all-MiniLM-L6-v2")
+        database = store._memory_database
+        admin = chromadb.AdminClient(store._settings)
+        assert database in [db["name"] for db in admin.list_databases()]
+
+        store.close()
+        store.close()  # Closing twice is harmless
+
+        assert database not in [db["name"] for db in admin.list_databases()]
+
+    @patch("vector_store._CachedEmbeddingFunction")
+    def test_embedding_function_loaded_once_per_model(self, mock_embed_class):
+        """Test that stores with the same model share one embedding function"""
+        _get_embedding_function.cache_clear()
+        try:
+            first = _get_embedding_function("model-a")
+            assert _get_embedding_function("model-a") is first
+            _get_embedding_function("model-b")
+            assert mock_embed_class.call_count == 2
+        finally:
+            _get_embedding_function.cache_clear()
+
+    def test_embedding_function_encodes_each_text_once(self, monkeypatch):
+        """Test that repeated texts are served from the embedding cache"""
+        monkeypatch.setattr(
+            SentenceTransformerEmbeddingFunction, "__init__", lambda self, **kw: None
+        )
+        embed = _CachedEmbeddingFunction(model_name="all-MiniLM-L6-v2")
+        embed.normalize_embeddings = False
+        embed._model = Mock()
+        embed._model.encode.side_effect = lambda texts, **kw: np.ones((len(texts), 4))
+
+        first = embed(["introduction", "test content", "introduction"])
+        second = embed(["test content", "new text"])
+
+        encoded = [c.args[0] for c in embed._model.encode.call_args_list]
+        assert encoded == [["introduction", "test content"], ["new text"]]
+        assert len(first) == 3 and len(second) == 2
+        assert second[0] is first[1]
+        assert embed._model.encode.call_args.kwargs["batch_size"] == 64
+
 
+@pytest.mark.unit
 class TestSearchResults:
     """Test suite for SearchResults class"""
 
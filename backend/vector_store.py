@@ -1,8 +1,16 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 import chromadb
+import numpy as np
+import orjson
 from chromadb.config import Settings
+from chromadb.utils.embedding_functions import SentenceTransformerEmbeddingFunction
 from models import Course, CourseChunk
 from sentence_transformers import SentenceTransformer
 
@@ -41,22 +49,105 @@ class SearchResults:
         return len(self.documents) == 0
 
 
+class _CachedEmbeddingFunction(SentenceTransformerEmbeddingFunction):
+    """Sentence-transformer embedding function that remembers recent texts"""
+
+    CACHE_SIZE = 2048
+    # Texts per forward pass when encoding many chunks at once
+    ENCODE_BATCH_SIZE = 64
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._cache: "OrderedDict[str, Any]" = OrderedDict()
+        # Sibling tool calls search from worker threads concurrently
+        self._cache_lock = threading.Lock()
+
+    def __call__(self, input):
+        # Take hits under the lock so a concurrent eviction can't lose them
+        with self._cache_lock:
+            found = {}
+            for text in input:
+                if text in self._cache:
+                    found[text] = self._cache[text]
+                    self._cache.move_to_end(text)
+        missing = [text for text in dict.fromkeys(input) if text not in found]
+
+        # Encode only unseen texts, still as a single batch
+        if missing:
+            embeddings = self._model.encode(
+                missing,
+                batch_size=self.ENCODE_BATCH_SIZE,
+                convert_to_numpy=True,
+                normalize_embeddings=self.normalize_embeddings,
+                show_progress_bar=False,
+            )
+            fresh = {
+                text: np.asarray(embedding, dtype=np.float32)
+                for text, embedding in zip(missing, embeddings)
+            }
+            found.update(fresh)
+            with self._cache_lock:
+                self._cache.update(fresh)
+                while len(self._cache) > self.CACHE_SIZE:
+                    self._cache.popitem(last=False)
+        return [found[text] for text in input]
+
+
+@lru_cache(maxsize=4)
+def _get_embedding_function(model_name: str):
+    """Load a sentence-transformer embedding function once per model name"""
+    return _CachedEmbeddingFunction(model_name=model_name)
+
+
 class VectorStore:
     """Vector storage using ChromaDB for course content and metadata"""
 
-    def __init__(self, chroma_path: str, embedding_model: str, max_results: int = 5):
-        self.max_results = max_results
-        # Initialize ChromaDB client
-        self.client = chromadb.PersistentClient(
-            path=chroma_path, settings=Settings(anonymized_telemetry=False)
-        )
+    # CHROMA_PATH value that keeps the store in memory, e.g. for tests
+    MEMORY_PATH = ":memory:"
 
-        # Set up sentence transformer embedding function
-        self.embedding_function = (
-            chromadb.utils.embedding_functions.SentenceTransformerEmbeddingFunction(
-                model_name=embedding_model
-            )
+    # Filtered searches with at most this many candidates per requested
+    # result are ranked locally instead of through Chroma's metadata filter
+    LOCAL_RANK_FACTOR = 10
+
+    # Collections larger than this are not copied locally; their filtered
+    # searches always go through Chroma
+    LOCAL_INDEX_MAX_CHUNKS = 20_000
+
+    # Recent search results, reused until the store changes or they expire
+    QUERY_CACHE_SIZE = 256
+    QUERY_CACHE_TTL = 300.0  # seconds
+
+    def __init__(
+        self,
+        chroma_path: str,
+        embedding_model: str,
+        max_results: int = 5,
+        client: Optional[Any] = None,
+        embedding_function: Optional[Any] = None,
+    ):
+        self.max_results = max_results
+        # (query, course, lesson, limit) -> (stored at, results)
+        self._query_cache: "OrderedDict[Tuple, Tuple[float, SearchResults]]" = (
+            OrderedDict()
         )
+        self._query_cache_lock = threading.Lock()
+        # Initialize ChromaDB client; an injected client is used as is
+        settings = Settings(anonymized_telemetry=False)
+        self._settings = settings
+        # Private database behind an in-memory store, deleted by close()
+        self._memory_database: Optional[str] = None
+        if client is not None:
+            self.client = client
+        elif chroma_path in (None, self.MEMORY_PATH):
+            self.client, self._memory_database = self._memory_client(settings)
+        else:
+            self.client = chromadb.PersistentClient(path=chroma_path, settings=settings)
+
+        # Set up sentence transformer embedding function, shared per model,
+        # unless the caller supplies its own
+        if embedding_function is None:
+            embedding_function = _get_embedding_function(embedding_model)
+        self.embedding_function = embedding_function
 
         # Create collections for different types of data
         self.course_catalog = self._create_collection(
@@ -66,6 +157,50 @@ class VectorStore:
             "course_content"
         )  # Actual course material
 
+        # Normalized title -> title, so exact course names resolve without a
+        # vector query; seeded with the courses already in the catalog
+        self._title_index: Dict[str, str] = {}
+        try:
+            self._index_titles(self.course_catalog.get(include=[])["ids"])
+        except Exception as e:
+            print(f"Error loading course titles: {e}")
+
+        # Local copy of the content chunks with an inverted index over their
+        # filter fields, so small filtered searches skip Chroma entirely. It
+        # is loaded on the first filtered search and then kept up to date by
+        # add_course_content, which assumes this store is the only writer:
+        # chunks another process adds to the same path are only seen by
+        # filtered searches after a restart
+        self._chunk_index_lock = threading.Lock()
+        self._reset_chunk_index(loaded=False)
+
+    @staticmethod
+    def _memory_client(settings: Settings) -> Tuple[Any, str]:
+        """Create an in-memory client backed by a private database, returning
+        the client and the database name to drop when done"""
+        # Ephemeral clients share one in-process system, so each store gets
+        # its own database to keep separate instances isolated
+        database = f"memory_{uuid.uuid4().hex}"
+        chromadb.AdminClient(settings).create_database(database)
+        return chromadb.EphemeralClient(settings=settings, database=database), database
+
+    @staticmethod
+    def _drop_memory_database(settings: Settings, database: str):
+        """Delete a database created by _memory_client"""
+        chromadb.AdminClient(settings).delete_database(database)
+
+    def close(self):
+        """Delete the private in-memory database, if this store created one"""
+        if self._memory_database is None:
+            return
+        try:
+            self.client.delete_collection("course_catalog")
+            self.client.delete_collection("course_content")
+            self._drop_memory_database(self._settings, self._memory_database)
+        except Exception as e:
+            print(f"Error deleting in-memory database: {e}")
+        self._memory_database = None
+
     def _create_collection(self, name: str):
         """Create or get a ChromaDB collection"""
         return self.client.get_or_create_collection(
@@ -91,6 +226,37 @@ class VectorStore:
         Returns:
             SearchResults object with documents and metadata
         """
+        # Use provided limit or fall back to configured max_results
+        search_limit = limit if limit is not None else self.max_results
+
+        # Repeated searches are answered from the cache
+        cache_key = (query, course_name, lesson_number, search_limit)
+        now = time.monotonic()
+        with self._query_cache_lock:
+            cached = self._query_cache.get(cache_key)
+            if cached is not None and now - cached[0] < self.QUERY_CACHE_TTL:
+                self._query_cache.move_to_end(cache_key)
+                return cached[1]
+
+        results = self._search_uncached(query, course_name, lesson_number, search_limit)
+
+        # Errors may be transient, so only successful results are kept
+        if results.error is None:
+            with self._query_cache_lock:
+                self._query_cache[cache_key] = (now, results)
+                self._query_cache.move_to_end(cache_key)
+                if len(self._query_cache) > self.QUERY_CACHE_SIZE:
+                    self._query_cache.popitem(last=False)
+        return results
+
+    def _search_uncached(
+        self,
+        query: str,
+        course_name: Optional[str],
+        lesson_number: Optional[int],
+        search_limit: int,
+    ) -> SearchResults:
+        """Resolve the course, then search content with the given limit"""
         # Step 1: Resolve course name if provided
         course_title = None
         if course_name:
@@ -102,10 +268,14 @@ class VectorStore:
         filter_dict = self._build_filter(course_title, lesson_number)
 
         # Step 3: Search course content
-        # Use provided limit or fall back to configured max_results
-        search_limit = limit if limit is not None else self.max_results
-
         try:
+            candidates = self._filter_candidates(course_title, lesson_number)
+            if (
+                candidates is not None
+                and len(candidates) <= search_limit * self.LOCAL_RANK_FACTOR
+            ):
+                return self._rank_locally(query, candidates, search_limit)
+
             results = self.course_content.query(
                 query_texts=[query], n_results=search_limit, where=filter_dict
             )
@@ -113,8 +283,57 @@ class VectorStore:
         except Exception as e:
             return SearchResults.empty(f"Search error: {str(e)}")
 
+    def _filter_candidates(
+        self, course_title: Optional[str], lesson_number: Optional[int]
+    ) -> Optional[Set[int]]:
+        """Positions of the chunks matching the filters, or None if unfiltered
+        or the local index is unavailable"""
+        if not course_title and lesson_number is None:
+            return None
+        if not self._ensure_chunk_index():
+            return None
+
+        matches = []
+        if course_title:
+            matches.append(self._inv_index["course_title"].get(course_title, set()))
+        if lesson_number is not None:
+            matches.append(self._inv_index["lesson_number"].get(lesson_number, set()))
+        return set.intersection(*matches)
+
+    def _rank_locally(
+        self, query: str, candidates: Set[int], limit: int
+    ) -> SearchResults:
+        """Rank candidate chunks against the query by the collection's metric"""
+        if not candidates or limit <= 0:
+            return SearchResults(documents=[], metadata=[], distances=[])
+
+        positions = sorted(candidates)
+        vectors = np.stack([self._chunk_vecs[i] for i in positions])
+        query_vec = np.asarray(self.embedding_function([query])[0], dtype=np.float32)
+
+        # Same distances Chroma reports for each space
+        if self._space == "cosine":
+            norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query_vec)
+            distances = 1.0 - (vectors @ query_vec) / np.maximum(norms, 1e-12)
+        elif self._space == "ip":
+            distances = 1.0 - vectors @ query_vec
+        else:
+            distances = ((vectors - query_vec) ** 2).sum(axis=1)
+
+        order = np.argsort(distances, kind="stable")[:limit]
+        return SearchResults(
+            documents=[self._chunks[positions[i]][0] for i in order],
+            metadata=[dict(self._chunks[positions[i]][1]) for i in order],
+            distances=[float(distances[i]) for i in order],
+        )
+
     def _resolve_course_name(self, course_name: str) -> Optional[str]:
         """Use vector search to find best matching course by name"""
+        # Exact titles, ignoring case and surrounding whitespace, skip the query
+        title = self._title_index.get(course_name.strip().lower())
+        if title is not None:
+            return title
+
         try:
             results = self.course_catalog.query(query_texts=[course_name], n_results=1)
 
@@ -126,8 +345,82 @@ class VectorStore:
 
         return None
 
+    def _reset_chunk_index(self, loaded: bool = True, disabled: bool = False):
+        """Forget the local chunk copies and re-read the content metric;
+        loaded says whether the (empty) copy already matches the collection"""
+        self._chunks_loaded = loaded
+        self._chunks_disabled = disabled
+        self._chunks: List[Tuple[str, Dict[str, Any]]] = []
+        self._chunk_vecs: List[np.ndarray] = []
+        self._chunk_ids: Set[str] = set()
+        self._inv_index: Dict[str, Dict[Any, Set[int]]] = {
+            "course_title": defaultdict(set),
+            "lesson_number": defaultdict(set),
+        }
+        try:
+            hnsw = self.course_content.configuration_json.get("hnsw") or {}
+            self._space = hnsw.get("space", "l2")
+        except Exception:
+            self._space = "l2"
+
+    def _ensure_chunk_index(self) -> bool:
+        """Load the local chunk copy on first use; False if it is unavailable"""
+        with self._chunk_index_lock:
+            if not self._chunks_loaded:
+                self._load_chunk_index()
+            return not self._chunks_disabled
+
+    def _load_chunk_index(self):
+        """Copy the stored chunks locally unless there are too many to hold"""
+        try:
+            if self.course_content.count() > self.LOCAL_INDEX_MAX_CHUNKS:
+                self._reset_chunk_index(disabled=True)
+                return
+            existing = self.course_content.get(
+                include=["documents", "metadatas", "embeddings"]
+            )
+            self._index_chunks(
+                existing["ids"],
+                existing["documents"],
+                existing["metadatas"],
+                existing["embeddings"],
+            )
+            self._chunks_loaded = True
+        except Exception as e:
+            # Chroma can still serve every search, just without the shortcut
+            print(f"Error loading course content: {e}")
+            self._reset_chunk_index(disabled=True)
+
+    def _index_chunks(self, ids, documents, metadatas, embeddings):
+        """Keep local copies of added chunks and index their filter fields"""
+        for chunk_id, document, metadata, embedding in zip(
+            ids, documents, metadatas, embeddings
+        ):
+            # Chroma ignores re-added ids, so the index does too
+            if chunk_id in self._chunk_ids:
+                continue
+            metadata = metadata or {}
+            position = len(self._chunks)
+            self._chunk_ids.add(chunk_id)
+            self._chunks.append((document, metadata))
+            self._chunk_vecs.append(np.asarray(embedding, dtype=np.float32))
+            for field in self._inv_index:
+                if metadata.get(field) is not None:
+                    self._inv_index[field][metadata[field]].add(position)
+
+    def _invalidate_query_cache(self):
+        """Drop cached search results after the stored data changes"""
+        with self._query_cache_lock:
+            self._query_cache.clear()
+
+    def _index_titles(self, titles):
+        """Record course titles in the exact-match title index"""
+        for title in titles:
+            self._title_index[title.strip().lower()] = title
+
+    @staticmethod
     def _build_filter(
-        self, course_title: Optional[str], lesson_number: Optional[int]
+        course_title: Optional[str], lesson_number: Optional[int]
     ) -> Optional[Dict]:
         """Build ChromaDB filter from search parameters"""
         if not course_title and lesson_number is None:
@@ -149,36 +442,43 @@ class VectorStore:
 
     def add_course_metadata(self, course: Course):
         """Add course information to the catalog for semantic search"""
-        import json
+        self.add_courses_metadata([course])
 
-        course_text = course.title
+    def add_courses_metadata(self, courses: List[Course]):
+        """Add several courses to the catalog in a single write"""
+        if not courses:
+            return
 
-        # Build lessons metadata and serialize as JSON string
-        lessons_metadata = []
-        for lesson in course.lessons:
-            lessons_metadata.append(
+        metadatas = []
+        for course in courses:
+            # Build lessons metadata and serialize as JSON string
+            lessons_metadata = [
                 {
                     "lesson_number": lesson.lesson_number,
                     "lesson_title": lesson.title,
                     "lesson_link": lesson.lesson_link,
                 }
-            )
-
-        self.course_catalog.add(
-            documents=[course_text],
-            metadatas=[
+                for lesson in course.lessons
+            ]
+            metadatas.append(
                 {
                     "title": course.title,
                     "instructor": course.instructor,
                     "course_link": course.course_link,
-                    "lessons_json": json.dumps(
+                    "lessons_json": orjson.dumps(
                         lessons_metadata
-                    ),  # Serialize as JSON string
+                    ).decode(),  # Serialize as JSON string
                     "lesson_count": len(course.lessons),
                 }
-            ],
-            ids=[course.title],
+            )
+
+        self.course_catalog.add(
+            documents=[course.title for course in courses],
+            metadatas=metadatas,
+            ids=[course.title for course in courses],
         )
+        self._index_titles(course.title for course in courses)
+        self._invalidate_query_cache()
 
     def add_course_content(self, chunks: List[CourseChunk]):
         """Add course content chunks to the vector store"""
@@ -200,7 +500,18 @@ class VectorStore:
             for chunk in chunks
         ]
 
-        self.course_content.add(documents=documents, metadatas=metadatas, ids=ids)
+        # Embed once and hand Chroma the vectors, which the local index keeps
+        embeddings = self.embedding_function(documents)
+        self.course_content.add(
+            documents=documents, metadatas=metadatas, ids=ids, embeddings=embeddings
+        )
+        # An unloaded copy picks these chunks up when it is first loaded
+        with self._chunk_index_lock:
+            if self._chunks_loaded and not self._chunks_disabled:
+                self._index_chunks(ids, documents, metadatas, embeddings)
+                if len(self._chunks) > self.LOCAL_INDEX_MAX_CHUNKS:
+                    self._reset_chunk_index(disabled=True)
+        self._invalidate_query_cache()
 
     def clear_all_data(self):
         """Clear all data from both collections"""
@@ -210,8 +521,12 @@ class VectorStore:
             # Recreate collections
             self.course_catalog = self._create_collection("course_catalog")
             self.course_content = self._create_collection("course_content")
+            self._title_index.clear()
+            with self._chunk_index_lock:
+                self._reset_chunk_index()
         except Exception as e:
             print(f"Error clearing data: {e}")
+        self._invalidate_query_cache()
 
     def get_existing_course_titles(self) -> List[str]:
         """Get all existing course titles from the vector store"""
@@ -238,8 +553,6 @@ class VectorStore:
 
     def get_all_courses_metadata(self) -> List[Dict[str, Any]]:
         """Get metadata for all courses in the vector store"""
-        import json
-
         try:
             results = self.course_catalog.get()
             if results and "metadatas" in results:
@@ -248,7 +561,9 @@ class VectorStore:
                 for metadata in results["metadatas"]:
                     course_meta = metadata.copy()
                     if "lessons_json" in course_meta:
-                        course_meta["lessons"] = json.loads(course_meta["lessons_json"])
+                        course_meta["lessons"] = orjson.loads(
+                            course_meta["lessons_json"]
+                        )
                         del course_meta[
                             "lessons_json"
                         ]  # Remove the JSON string version
@@ -274,8 +589,6 @@ class VectorStore:
 
     def get_lesson_link(self, course_title: str, lesson_number: int) -> Optional[str]:
         """Get lesson link for a given course title and lesson number"""
-        import json
-
         try:
             # Get course by ID (title is the ID)
             results = self.course_catalog.get(ids=[course_title])
@@ -283,7 +596,7 @@ class VectorStore:
                 metadata = results["metadatas"][0]
                 lessons_json = metadata.get("lessons_json")
                 if lessons_json:
-                    lessons = json.loads(lessons_json)
+                    lessons = orjson.loads(lessons_json)
                     # Find the lesson with matching number
                     for lesson in lessons:
                         if lesson.get("lesson_number") == lesson_number: